@@ -19,6 +19,10 @@ import machine
 import socket
 import time
 import pycom
+import binascii
+import gc
+import select
+from array import array
 
 print("main.py - V1.8")
 
@@ -35,6 +39,36 @@ WIFI = False
 SSID = 'LoRaToolbox'
 PW = '1234567890'
 IP = '0.0.0.0'
+JOB = b'IDLE'       # current job, reported in the STATUS reply
+JOB_ID = 0          # id of the current job given by the desktop scheduler, 0 if none
+ABORT = False       # set by an ABORT request during a job, the job loops end as soon as possible
+PENDING = []        # commands received during a job, started after it
+PENDING_MAX = 4
+BURST_HDR = 6       # burst payload suffix: 2 byte sequence number + 4 byte Tx timestamp (ms)
+BURST_MAX = 65535   # highest sequence number which fits into the 2 byte suffix
+BURST_REPORT = 10   # seconds between the interim statistics of a burst Rx session
+CAPTURE_BATCH = 16  # captured packets per batch on the capture stream
+CAPTURE_FLUSH = 1000 # ms after which an incomplete batch is sent anyway
+GC_STEP = 16384     # bytes allocated during a job until the garbage is collected in the next pause
+SYNC_TIMEOUT = 2    # seconds a clock synchronisation waits for the next PING before the connection is closed
+HEX = b'0123456789abcdef'
+
+# preallocated buffers, so the loops of the jobs don't allocate new objects for every packet
+LINE = bytearray(640)    # every line sent to the desktop is built in here
+RX_BUF = bytearray(256)  # received LoRa packets
+captureBuf = bytearray(CAPTURE_BATCH * 256)
+captureSlots = [memoryview(captureBuf)[i * 256:(i + 1) * 256] for i in range(CAPTURE_BATCH)]
+captureLen = array('i', [0] * CAPTURE_BATCH)
+captureTime = array('i', [0] * CAPTURE_BATCH)
+captureRssi = array('i', [0] * CAPTURE_BATCH)
+captureSnr = array('i', [0] * CAPTURE_BATCH)
+stampSeq = array('i', [0] * CAPTURE_BATCH)
+stampTx = array('i', [0] * CAPTURE_BATCH)
+stampRx = array('i', [0] * CAPTURE_BATCH)
+jobStream = None    # stream for all replies of a running job
+jobAddr = None
+gcMark = 0
+HEAP_LARGEST = 0    # largest free heap block of the last heap check
 
 #variables initialization as method (to re-run after Tx and Rx) / fallback valuess
 def initVARS():
@@ -87,6 +121,7 @@ while WIFI == False:
 
 
 IP = wlan.ifconfig()[0]
+PREFIX = (IP + ':').encode('utf-8')
 print("LoPy has the IP: {}".format(IP))
 # disabling the blue heartbeat LED
 pycom.heartbeat(False)
@@ -97,23 +132,221 @@ ipSocket.bind(('', PORT))
 print("socket binded to %s" % (PORT))
 ipSocket.listen(5)
 print("socket is listening")
+# poller to check for STATUS requests during a running job without blocking
+poller = select.poll()
+poller.register(ipSocket, select.POLLIN)
+
+# function to encode the current job for the STATUS reply, the job is kept as bytes
+# so the reply can be built without allocations while a job is running
+def setJob(mode, jobId=0):
+    global JOB, JOB_ID, ABORT
+    JOB = mode.encode('utf-8')
+    JOB_ID = jobId
+    ABORT = False
+
+# function to collect the garbage and measure the heap at the end of a job and in
+# between jobs. The largest free block is found by trying allocations, so it's only
+# done at these controlled points and kept for the STATUS reply
+def heapCheck():
+    global HEAP_LARGEST, gcMark
+    gc.collect()
+    low = 0
+    high = gc.mem_free()
+    while high - low > 1024:
+        size = (low + high) // 2
+        try:
+            block = bytearray(size)
+            block = None
+            low = size
+        except MemoryError:
+            high = size
+    gc.collect()
+    HEAP_LARGEST = low
+    gcMark = gc.mem_alloc()
+
+# function to collect the garbage during a pause of a job, but only if enough
+# memory was allocated since the last collection
+def gcStep():
+    global gcMark
+    if gc.mem_alloc() > gcMark + GC_STEP:
+        gc.collect()
+        gcMark = gc.mem_alloc()
+
+# functions to write into the preallocated LINE buffer, they return the next position
+def putBytes(pos, data):
+    for i in range(len(data)):
+        LINE[pos + i] = data[i]
+    return pos + len(data)
+
+def putInt(pos, value):
+    if value < 0:
+        LINE[pos] = 45
+        pos = pos + 1
+        value = -value
+    start = pos
+    while True:
+        LINE[pos] = 48 + value % 10
+        pos = pos + 1
+        value = value // 10
+        if value == 0:
+            break
+    end = pos - 1
+    while start < end:
+        LINE[start], LINE[end] = LINE[end], LINE[start]
+        start = start + 1
+        end = end - 1
+    return pos
+
+# SNR in steps of 0.25 dB, given as quarters
+def putQuarters(pos, value):
+    if value < 0:
+        LINE[pos] = 45
+        pos = pos + 1
+        value = -value
+    pos = putInt(pos, value >> 2)
+    LINE[pos] = 46
+    return putInt(pos + 1, (value & 3) * 25)
 
-# function to send a socket over the network to a given IP address
+def putHex(pos, data, length):
+    for i in range(length):
+        LINE[pos] = HEX[data[i] >> 4]
+        LINE[pos + 1] = HEX[data[i] & 15]
+        pos = pos + 2
+    return pos
+
+# function to compare the start of a received packet without slicing it
+def startsWith(data, length, prefix):
+    if length < len(prefix):
+        return False
+    for i in range(len(prefix)):
+        if data[i] != prefix[i]:
+            return False
+    return True
+
+# function to build the STATUS reply with the current job, free heap, WiFi RSSI,
+# uptime in seconds, the largest free heap block of the last heap check and the job id
+def statusReply():
+    try:
+        rssi = wlan.joined_ap_info()[4]
+    except:
+        rssi = 0
+    pos = putBytes(0, b'STATUS:')
+    pos = putBytes(pos, JOB)
+    LINE[pos] = 58
+    pos = putInt(pos + 1, gc.mem_free())
+    LINE[pos] = 58
+    pos = putInt(pos + 1, rssi)
+    LINE[pos] = 58
+    pos = putInt(pos + 1, time.ticks_ms() // 1000)
+    LINE[pos] = 58
+    pos = putInt(pos + 1, HEAP_LARGEST)
+    LINE[pos] = 58
+    pos = putInt(pos + 1, JOB_ID)
+    LINE[pos] = 10
+    return pos + 1
+
+# function to answer STATUS requests while a job is running, it has to be called
+# regularly in all loops. ABORT:<job id> ends the running job if the id matches.
+# PING requests are answered, so the clocks can be synchronised right after a
+# burst even if the next job already runs. Other commands are kept and started
+# after the job, as they would be from the listen backlog
+def serviceStatus():
+    global ABORT
+    for _ in poller.ipoll(0):
+        try:
+            c, addr = ipSocket.accept()
+            c.settimeout(0.5)
+            data = c.recv(1024).decode()
+            rxTime = time.ticks_ms()
+            if data.startswith("STATUS"):
+                c.write(LINE, statusReply())
+                c.close()
+            elif data.startswith("PING:"):
+                clockSync(c, data, rxTime)
+            elif data.startswith("ABORT:"):
+                if JOB_ID and int(data[6:]) == JOB_ID:
+                    print('Job {} aborted'.format(JOB_ID))
+                    ABORT = True
+                c.close()
+            elif len(PENDING) >= PENDING_MAX:
+                c.close()
+            else:
+                PENDING.append((c, addr, data))
+        except:
+            print('Status request failed')
+
+# function to wait ms milliseconds while answering STATUS requests, longer pauses
+# are used to collect the garbage. The requests are answered at least once, so jobs
+# without pause still reply to the health monitor. The time is given in integer ms,
+# a float would be allocated on every call
+def idleWait(ms):
+    endTime = time.ticks_add(time.ticks_ms(), ms)
+    if ms >= 50:
+        gcStep()
+    serviceStatus()
+    while time.ticks_diff(endTime, time.ticks_ms()) > 0:
+        time.sleep_ms(max(0, min(50, time.ticks_diff(endTime, time.ticks_ms()))))
+        serviceStatus()
+
+# function to send data over the job stream to the desktop
 # as the LoRa Tx, Rx or even scan sessions might be a bit longer
 # it's possible that a socket is already closed and the reply to 
 # the already open Mainloop socket will fail. 
-# Therefore the mainloop socket is closed on the client site after
-# transmission as the client has an always open listener socket
+# Therefore the replies of a job are sent over an own stream to the
+# client's always open listener socket. The stream is opened with the
+# first reply of a job, kept open until the end of the job and opened
+# again once if it broke
+def sendStream(addr, data, length):
+    global jobStream, jobAddr
+    if addr != jobAddr:
+        closeStream()
+        jobAddr = addr
+    for attempt in range(2):
+        try:
+            if jobStream is None:
+                jobStream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                jobStream.connect((addr, PORT))
+            jobStream.write(data, length)
+            return
+        except:
+            closeStream()
+    print('Socket Error')
+
+# function to close the job stream at the end of a job
+def closeStream():
+    global jobStream, jobAddr
+    if jobStream is not None:
+        try:
+            jobStream.close()
+        except:
+            print('Problem during Socket connection')
+    jobStream = None
+    jobAddr = None
+
+# function to send a status reply to a given IP address, mode and status are bytes
+# the id of a scheduled job is appended, so the desktop can match START and END
 def sendSocket(addr, mode, status, freq, sf):
-    try:
-        clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        clientSocket.connect((addr, PORT))   
-        clientSocket.sendall("{}:{}:{}:{}:{}\n".format(IP, mode, status, freq, sf)) 
-        clientSocket.close()
-    except socket.error:
-        print('Socket Error')
-    except:
-        print('Problem during Socket connection')
+    pos = putBytes(0, PREFIX)
+    pos = putBytes(pos, mode)
+    LINE[pos] = 58
+    pos = putBytes(pos + 1, status)
+    LINE[pos] = 58
+    pos = putInt(pos + 1, freq)
+    LINE[pos] = 58
+    pos = putInt(pos + 1, sf)
+    if JOB_ID:
+        LINE[pos] = 58
+        pos = putInt(pos + 1, JOB_ID)
+    LINE[pos] = 10
+    sendStream(addr, LINE, pos + 1)
+
+# function to send the statistics of a burst session to a given IP address
+# the reply is built like the status reply, the status is always STATS and
+# followed by received, lost, duplicated and reordered packets, the achieved
+# packets per second and the goodput in bytes per second
+def sendStats(addr, mode, received, lost, dup, reordered, pps, goodput):
+    line = "{}:{}:STATS:{}:{}:{}:{}:{:.2f}:{:.2f}\n".format(IP, mode, received, lost, dup, reordered, pps, goodput)
+    sendStream(addr, line, len(line))
     
 
 # function for the LoRa Rx
@@ -122,58 +355,75 @@ def LoRaRX(addr, msg):
     i = 1
     epochTime = int(time.time())
     durationTime = int(float(Repeat))*60
+    freq = int(FQ)
+    sf = int(SF)
+    # the expected message is encoded once and compared with the receive buffer
+    expected = msg.encode('utf-8')
     # LoRa Rx settings
-    lora = LoRa(mode=LoRa.LORA, region=LoRa.EU868, sf=int(SF), frequency=int(FQ))
+    lora = LoRa(mode=LoRa.LORA, region=LoRa.EU868, sf=sf, frequency=freq)
     s = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
     s.setblocking(False)
     if int(float(Repeat)) == 0:
-        print("Receive Loop started, MicroController needs a reset to receive new inputs")
-        sendSocket(addr, 'RX','START', 0, 0)
-        while True:
-            #if s.recv(64) == b'LoRa Toolbox':
-            if s.recv(64) == msg.encode('utf-8'):
-                print('LoRa message received - Nr. {}'.format(i))
-                sendSocket(addr, 'RX','SUCCESS', FQ, SF)
+        print("Receive Loop started, runs until it is aborted by the desktop or a reset")
+        sendSocket(addr, b'RX', b'START', 0, 0)
+        while not ABORT:
+            n = s.readinto(RX_BUF)
+            if n == len(expected) and startsWith(RX_BUF, n, expected):
+                print('LoRa message received - Nr.', i)
+                sendSocket(addr, b'RX', b'SUCCESS', freq, sf)
                 i = i+1
-            time.sleep(0.1)
+            idleWait(100)
+        sendSocket(addr, b'RX', b'END', 0, 0)
     else:
         print("Repeat for {} minutes".format(int(float(Repeat))))
-        sendSocket(addr, 'RX','START', 0, 0)
-        while int(time.time()) < epochTime+durationTime:
-            if s.recv(64) == msg.encode('utf-8'):
-                print('Msg received - Nr. {}'.format(i))
-                sendSocket(addr, 'RX','SUCCESS', FQ, SF)
+        sendSocket(addr, b'RX', b'START', 0, 0)
+        while int(time.time()) < epochTime+durationTime and not ABORT:
+            n = s.readinto(RX_BUF)
+            if n == len(expected) and startsWith(RX_BUF, n, expected):
+                print('Msg received - Nr.', i)
+                sendSocket(addr, b'RX', b'SUCCESS', freq, sf)
                 i = i+1
-            time.sleep(0.1)
-        sendSocket(addr, 'RX','END', 0, 0)
+            idleWait(100)
+        sendSocket(addr, b'RX', b'END', 0, 0)
     s.close()
 
 # function for the scanning mode
+# the LoRa object and the socket are created once and only retuned for each step
 def scan(addr, msg):
-    print("Scan Loop started, MicroController needs a reset to receive new inputs")
-    sendSocket(addr, 'SCAN','START', 0, 0)
+    print("Scan Loop started, runs until all steps are done or it is aborted by the desktop")
+    sendSocket(addr, b'SCAN', b'START', 0, 0)
+    lora = LoRa(mode=LoRa.LORA, region=LoRa.EU868, sf=7, frequency=863000000)
+    s = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
+    s.setblocking(False)
     for freq in range(863000000, 880000000, 1000000):
-        print("Freq {}".format(freq))
+        if ABORT:
+            break
+        print("Freq", freq)
+        lora.frequency(freq)
         for sf in range(7, 13, 1):
-            print("SF {}".format(sf))
-            lora = LoRa(mode=LoRa.LORA, region=LoRa.EU868, sf=int(sf), frequency=int(freq))
-            s = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
-            s.setblocking(False)
-            s.settimeout(10.0)
-            epochTime = int(time.time())
-            try:
-                if s.recv(64):
-                    print('LoRa message received on frequency {} with SF {}'.format(freq, sf))
-                    sendSocket(addr, 'SCAN','SUCCESS', freq, sf)
-            except socket.timeout:
+            if ABORT:
+                break
+            print("SF", sf)
+            lora.sf(sf)
+            gcStep()
+            # listen for 10 seconds on each freq+sf
+            endTime = time.ticks_add(time.ticks_ms(), 10000)
+            received = False
+            while not received and not ABORT and time.ticks_diff(endTime, time.ticks_ms()) > 0:
+                received = bool(s.readinto(RX_BUF))
+                if not received:
+                    idleWait(50)
+            if received:
+                print('LoRa message received on frequency', freq, 'with SF', sf)
+                sendSocket(addr, b'SCAN', b'SUCCESS', freq, sf)
+            elif not ABORT:
                 print('No packet received on this freq+sf')
-    sendSocket(addr, 'SCAN','END', 0, 0)       
+    sendSocket(addr, b'SCAN', b'END', 0, 0)
     s.close()
 
 
-# function for the LoRa Tx
-def LoRaTX(addr, msg):
-    # adjusting the LoRa parameters to match the required format
+# function to adjust the LoRa parameters to match the required format
+def loraTxParams():
     if BW == 125:
         BWparam = BW125
     elif BW == 250:
@@ -190,39 +440,319 @@ def LoRaTX(addr, msg):
         FECparam = FEC48
     else:
         FECparam = FEC45
+    return BWparam, FECparam
 
+
+# function for the LoRa Tx
+def LoRaTX(addr, msg):
+    BWparam, FECparam = loraTxParams()
+    # the payload and the pause are converted once
+    payload = msg.encode('utf-8')
+    pause = int(float(Pause))
+    pauseMs = pause * 1000
     # LoRa Tx settings
     lora = LoRa(mode=LoRa.LORA, region=LoRa.EU868, frequency=int(FQ), bandwidth=BWparam, coding_rate=FECparam, sf=int(SF), tx_power=int(TX))
     s = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
+    s.setblocking(True)
     if int(float(Repeat)) == 0:
-        print("while True loop started with {} seconds of pause between the transmits".format(int(float(Pause))))
-        print("A reset is required to start receive different instructions")
-        sendSocket(addr, 'TX','START', 0, 0)       
-        while True:
-            s.setblocking(True)
-            s.send(msg)
+        print("while True loop started with {} seconds of pause between the transmits".format(pause))
+        print("It runs until it is aborted by the desktop or a reset")
+        sendSocket(addr, b'TX', b'START', 0, 0)
+        while not ABORT:
+            s.send(payload)
             pycom.heartbeat(True)
-            time.sleep(int(float(Pause)))
+            idleWait(pauseMs)
+        sendSocket(addr, b'TX', b'END', 0, 0)
+        pycom.heartbeat(False)
     else:
-        print("Tx for loop started with {} iterations and {} seconds of pause in between".format(int(float(Repeat)), int(float(Pause))))
-        sendSocket(addr, 'TX','START', 0, 0)       
+        print("Tx for loop started with {} iterations and {} seconds of pause in between".format(int(float(Repeat)), pause))
+        sendSocket(addr, b'TX', b'START', 0, 0)
         for x in range(int(float(Repeat))):
-            s.setblocking(True)
-            s.send(msg)
+            s.send(payload)
             pycom.heartbeat(True)
-            time.sleep(int(float(Pause)))
+            idleWait(pauseMs)
+            if ABORT:
+                break
         print("Transmit finished")
-        sendSocket(addr, 'TX','END', 0, 0)       
+        sendSocket(addr, b'TX', b'END', 0, 0)
         pycom.heartbeat(False)
     s.close()
 
 
+# function to convert the message of a capture session into a list of prefix filters
+# the prefixes are separated by '|', a prefix starting with 0x is given as hex bytes.
+# An empty message or '*' captures every packet. Example: LoRa|0x4c6f
+def captureFilter(msg):
+    prefixes = []
+    if msg == '' or msg == '*':
+        return prefixes
+    for prefix in msg.split('|'):
+        if prefix.startswith('0x'):
+            prefixes.append(binascii.unhexlify(prefix[2:]))
+        else:
+            prefixes.append(prefix.encode('utf-8'))
+    return prefixes
+
+# function to send a batch of captured packets over the job stream
+# each packet is one line with frequency, SF, the age of the packet in ms when the
+# batch was sent, RSSI, SNR and the payload as hex
+def sendCapture(addr, freq, sf, count):
+    now = time.ticks_ms()
+    for slot in range(count):
+        pos = putBytes(0, PREFIX)
+        pos = putBytes(pos, b'CAPTURE:DATA:')
+        pos = putInt(pos, freq)
+        LINE[pos] = 58
+        pos = putInt(pos + 1, sf)
+        LINE[pos] = 58
+        pos = putInt(pos + 1, time.ticks_diff(now, captureTime[slot]))
+        LINE[pos] = 58
+        pos = putInt(pos + 1, captureRssi[slot])
+        LINE[pos] = 58
+        pos = putQuarters(pos + 1, captureSnr[slot])
+        LINE[pos] = 58
+        pos = putHex(pos + 1, captureSlots[slot], captureLen[slot])
+        LINE[pos] = 10
+        sendStream(addr, LINE, pos + 1)
+
+# function to send a batch of burst Rx timestamps over the job stream
+# each packet is one line with the sequence number, the Tx timestamp of the sending
+# node and the Rx timestamp of this node. Both are the ticks in ms of each node, the
+# desktop converts them with the clock offsets of the PING exchange
+def sendStamps(addr, count):
+    for slot in range(count):
+        pos = putBytes(0, PREFIX)
+        pos = putBytes(pos, b'BURSTRX:STAMP:')
+        pos = putInt(pos, stampSeq[slot])
+        LINE[pos] = 58
+        pos = putInt(pos + 1, stampTx[slot])
+        LINE[pos] = 58
+        pos = putInt(pos + 1, stampRx[slot])
+        LINE[pos] = 10
+        sendStream(addr, LINE, pos + 1)
+
+# function for the NTP like clock synchronisation with the desktop
+# every line PING:<desktop time> is answered with PONG:<desktop time>:<rx time>:<tx time>
+# with the rx and tx time in ticks ms of this node. The exchange is repeated until the
+# desktop closes the connection or sends no PING for SYNC_TIMEOUT seconds
+def clockSync(c, data, rxTime):
+    try:
+        c.settimeout(SYNC_TIMEOUT)
+        while data:
+            for line in data.split("\n"):
+                if line.startswith("PING:"):
+                    c.sendall("PONG:{}:{}:{}\n".format(line[5:], rxTime, time.ticks_ms()))
+            data = c.recv(1024).decode()
+            rxTime = time.ticks_ms()
+    except:
+        print('Clock synchronisation failed')
+    c.close()
+
+# function for the promiscuous capture mode
+# every received packet which matches one of the prefix filters is forwarded with
+# RSSI, SNR and its age. The packets are received directly into the preallocated
+# slots of a batch, a batch of CAPTURE_BATCH is sent over the job stream to save
+# WiFi airtime
+def LoRaCapture(addr, msg):
+    prefixes = captureFilter(msg)
+    count = 0
+    durationTime = int(float(Repeat))*60
+    epochTime = int(time.time())
+    freq = int(FQ)
+    sf = int(SF)
+    lora = LoRa(mode=LoRa.LORA, region=LoRa.EU868, sf=sf, frequency=freq)
+    s = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
+    s.setblocking(False)
+    print("Capture started for {} minutes (0 = infinite) with {} filters".format(durationTime // 60, len(prefixes)))
+    sendSocket(addr, b'CAPTURE', b'START', 0, 0)
+    while (durationTime == 0 or int(time.time()) < epochTime+durationTime) and not ABORT:
+        n = s.readinto(captureSlots[count])
+        if n:
+            match = not prefixes
+            for prefix in prefixes:
+                if startsWith(captureSlots[count], n, prefix):
+                    match = True
+                    break
+            if match:
+                stats = lora.stats()
+                captureTime[count] = time.ticks_ms()
+                captureLen[count] = n
+                captureRssi[count] = stats.rssi
+                captureSnr[count] = int(stats.snr * 4)
+                count = count + 1
+        else:
+            gcStep()
+            idleWait(5)
+        if count and (count >= CAPTURE_BATCH or time.ticks_diff(time.ticks_ms(), captureTime[0]) >= CAPTURE_FLUSH):
+            sendCapture(addr, freq, sf, count)
+            count = 0
+            gcStep()
+    s.close()
+    if count:
+        sendCapture(addr, freq, sf, count)
+    sendSocket(addr, b'CAPTURE', b'END', 0, 0)
+
+
+# function for the LoRa burst Tx
+# every packet is the message followed by a 2 byte sequence number and the 4 byte
+# Tx timestamp in ms, all packets are sent back to back without any pause so the
+# receiving side can measure the packet loss and the achievable packet rate.
+# Repeat is the number of packets, 0 sends the maximum of BURST_MAX + 1 packets
+def LoRaBurstTX(addr, msg):
+    BWparam, FECparam = loraTxParams()
+    count = int(float(Repeat))
+    if count <= 0 or count > BURST_MAX + 1:
+        count = BURST_MAX + 1
+    # the payload is allocated once, only the suffix is rewritten for each packet
+    payload = bytearray(msg.encode('utf-8') + bytes(BURST_HDR))
+    hdr = len(payload) - BURST_HDR
+    lora = LoRa(mode=LoRa.LORA, region=LoRa.EU868, frequency=int(FQ), bandwidth=BWparam, coding_rate=FECparam, sf=int(SF), tx_power=int(TX))
+    s = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
+    s.setblocking(True)
+    print("Burst Tx started with {} packets".format(count))
+    sendSocket(addr, b'BURST', b'START', 0, 0)
+    pycom.heartbeat(True)
+    startTime = time.ticks_ms()
+    for seq in range(count):
+        txTime = time.ticks_ms()
+        payload[hdr] = seq >> 8
+        payload[hdr + 1] = seq & 255
+        payload[hdr + 2] = (txTime >> 24) & 255
+        payload[hdr + 3] = (txTime >> 16) & 255
+        payload[hdr + 4] = (txTime >> 8) & 255
+        payload[hdr + 5] = txTime & 255
+        s.send(payload)
+        serviceStatus()
+        if ABORT:
+            count = seq + 1
+            break
+    elapsed = time.ticks_diff(time.ticks_ms(), startTime)
+    pycom.heartbeat(False)
+    s.close()
+    print("Burst finished, {} packets in {} ms".format(count, elapsed))
+    if elapsed > 0:
+        sendStats(addr, 'BURST', count, 0, 0, 0, count * 1000 / elapsed, count * hdr * 1000 / elapsed)
+    sendSocket(addr, b'BURST', b'END', 0, 0)
+
+
+# function for the LoRa burst Rx
+# counterpart of LoRaBurstTX, every sequence number is marked in a bitmap to detect
+# lost, duplicated and reordered packets. Packets are counted as lost if they are
+# missing below the highest received sequence number. The statistics are sent every
+# BURST_REPORT seconds and at the end of the session
+def LoRaBurstRX(addr, msg):
+    prefix = msg.encode('utf-8')
+    hdr = len(prefix)
+    size = hdr + BURST_HDR
+    seen = bytearray(BURST_MAX // 8 + 1)
+    received = 0
+    dup = 0
+    reordered = 0
+    highest = -1
+    highestTx = 0
+    firstTime = 0
+    lastTime = 0
+    count = 0
+    durationTime = int(float(Repeat))*60
+    epochTime = int(time.time())
+    reportTime = epochTime + BURST_REPORT
+    lora = LoRa(mode=LoRa.LORA, region=LoRa.EU868, sf=int(SF), frequency=int(FQ))
+    s = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
+    s.setblocking(False)
+    print("Burst Rx started for {} minutes (0 = infinite)".format(durationTime // 60))
+    sendSocket(addr, b'BURSTRX', b'START', 0, 0)
+    while (durationTime == 0 or int(time.time()) < epochTime+durationTime) and not ABORT:
+        n = s.readinto(RX_BUF)
+        if n == size and startsWith(RX_BUF, n, prefix):
+            lastTime = time.ticks_ms()
+            if received == 0 and dup == 0:
+                firstTime = lastTime
+            seq = (RX_BUF[hdr] << 8) | RX_BUF[hdr + 1]
+            txTime = (RX_BUF[hdr + 2] << 24) | (RX_BUF[hdr + 3] << 16) | (RX_BUF[hdr + 4] << 8) | RX_BUF[hdr + 5]
+            # a lower sequence number which was sent after the highest one starts a new burst in the same Rx window,
+            # reordered and duplicated packets were sent before it. The statistics of the finished burst are sent
+            # and the counters reset.
+            if seq < highest and time.ticks_diff(txTime, highestTx) > 0:
+                burstStats(addr, received, dup, reordered, highest, firstTime, lastTime, hdr)
+                for i in range(len(seen)):
+                    seen[i] = 0
+                received = 0
+                dup = 0
+                reordered = 0
+                highest = -1
+                firstTime = lastTime
+            if seen[seq >> 3] & (1 << (seq & 7)):
+                dup = dup + 1
+            else:
+                seen[seq >> 3] |= 1 << (seq & 7)
+                received = received + 1
+                stampSeq[count] = seq
+                stampTx[count] = txTime
+                stampRx[count] = lastTime
+                count = count + 1
+                if seq < highest:
+                    reordered = reordered + 1
+                else:
+                    highest = seq
+                    highestTx = txTime
+        else:
+            gcStep()
+            idleWait(5)
+        if count and (count >= CAPTURE_BATCH or time.ticks_diff(time.ticks_ms(), stampRx[0]) >= CAPTURE_FLUSH):
+            sendStamps(addr, count)
+            count = 0
+            gcStep()
+        if int(time.time()) >= reportTime:
+            reportTime = int(time.time()) + BURST_REPORT
+            burstStats(addr, received, dup, reordered, highest, firstTime, lastTime, hdr)
+    s.close()
+    if count:
+        sendStamps(addr, count)
+    burstStats(addr, received, dup, reordered, highest, firstTime, lastTime, hdr)
+    sendSocket(addr, b'BURSTRX', b'END', 0, 0)
+
+# function to calculate and send the current statistics of a burst Rx session
+def burstStats(addr, received, dup, reordered, highest, firstTime, lastTime, msgLen):
+    elapsed = time.ticks_diff(lastTime, firstTime)
+    pps = 0
+    goodput = 0
+    if elapsed > 0:
+        pps = (received - 1) * 1000 / elapsed
+        goodput = (received - 1) * msgLen * 1000 / elapsed
+    print("Burst Rx: {} received, {} lost, {} duplicates, {} reordered".format(received, highest + 1 - received, dup, reordered))
+    sendStats(addr, 'BURSTRX', received, highest + 1 - received, dup, reordered, pps, goodput)
+
+
+# first heap check for the STATUS reply
+heapCheck()
+
 # Main loop for the MicroController
 while True:
-    print('Ready for new connection')
-    c, addr = ipSocket.accept()
-    print('Got connection from', addr)
-    data = c.recv(1024).decode()
+    if PENDING:
+        c, addr, data = PENDING.pop(0)
+        print('Queued connection from', addr)
+    else:
+        print('Ready for new connection')
+        c, addr = ipSocket.accept()
+        print('Got connection from', addr)
+        data = c.recv(1024).decode()
+    rxTime = time.ticks_ms()
+    # clock synchronisation requests are answered on the same connection
+    if data.startswith("PING:"):
+        clockSync(c, data, rxTime)
+        continue
+    # heartbeat of the desktop health monitor
+    if data.startswith("STATUS"):
+        try:
+            c.write(LINE, statusReply())
+        except:
+            print('Status request failed')
+        c.close()
+        continue
+    # abort of a job which already ended
+    if data.startswith("ABORT:"):
+        c.close()
+        continue
     # Splitting surrounded by a try/except in case a random socket or incorrect instruction set is received
     try:
         lora_list = data.split(":")
@@ -239,6 +769,12 @@ while True:
         Repeat = lora_list[5]
         Pause = lora_list[6]
         Msg = lora_list[8]
+        # the desktop scheduler appends the job id, it's echoed in the replies of the job
+        if len(lora_list) > 9 and lora_list[9].isdigit():
+            setJob(Mode, int(lora_list[9]))
+        else:
+            setJob(Mode)
+        heapCheck()
         if Mode == "TX":
             print("Starting Tx")
             LoRaTX(addr[0], Msg)
@@ -248,8 +784,20 @@ while True:
         if Mode == "SCAN":
             print("Starting Scan mode")
             scan(addr[0], Msg)
+        if Mode == "BURST":
+            print("Starting burst Tx")
+            LoRaBurstTX(addr[0], Msg)
+        if Mode == "BURSTRX":
+            print("Starting burst Rx")
+            LoRaBurstRX(addr[0], Msg)
+        if Mode == "CAPTURE":
+            print("Starting capture mode")
+            LoRaCapture(addr[0], Msg)
         initVARS()
     except:
         print("Error! Please check the parameters and the network. Also a 'rogue socket connection' could be the case")
+    closeStream()
+    setJob('IDLE')
+    heapCheck()
     c.close()
     time.sleep(0.01)
@@ -32,6 +32,25 @@ import platform
 import sys
 # Time
 from datetime import datetime
+import time
+# Capture files
+import os
+import struct
+# Health monitor
+import asyncio
+import random
+# Job scheduler
+import heapq
+import itertools
+import math
+# Command line arguments
+import argparse
+# Profiling and tracing
+import collections
+import contextlib
+import json
+import signal
+import tracemalloc
 
 # constant declaration
 BW = ["125", "250", "500"]
@@ -39,8 +58,24 @@ FREQ = ["863000000", "864000000", "865000000", "866000000", "867000000", "868000
 FEC = ["4_5", "4_6", "4_7", "4_8"]
 SF = ["7", "8", "9", "10", "11", "12"]
 TXP = ["2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14"]
+PRIO = ["high", "normal", "low"]
 IP = socket.gethostname()
 PORT = 4711
+PCAP_LINKTYPE_LORATAP = 270  # pcap link type of the LoRaTap header which is supported by Wireshark
+LORATAP_SYNC_WORD = 0x34  # sync word of the public LoRa networks, the default of the LoPy
+HEARTBEAT_INTERVAL = 2.0  # seconds between two heartbeats of a node
+HEARTBEAT_TIMEOUT = 1.5  # seconds to wait for the connection and for the STATUS reply
+HEARTBEAT_DEAD = 2  # failed heartbeats in a row until a node is flagged as dead
+HEARTBEAT_CONCURRENCY = 256  # maximum of heartbeats at the same time, limits the open sockets
+HEAP_LOW = 20000  # free heap in bytes below a node is flagged as degraded
+HEAP_BLOCK_LOW = 8192  # largest free heap block in bytes below a node is flagged as degraded (fragmented heap)
+RSSI_LOW = -85  # WiFi RSSI in dBm below a node is flagged as degraded
+RECORD_MAGIC = b'LTRC\x01'  # file header of a listener recording, version 1
+RECORD_HEADER = struct.Struct('>QI4sHH')  # monotonic time in ns, connection, source IP and port, data length
+JOB_GRACE = 30  # seconds after the estimated end until a job without END reply is treated as finished
+SCAN_DURATION = 17 * 6 * 10  # 17 frequencies with 6 spreading factors and 10 seconds each
+PROFILE_INTERVAL = 0.005  # seconds between two samples of the sampling profiler
+TRACE_EVENTS = 100000  # maximum of kept trace events, the oldest are dropped
 OS = platform.system()  # OS detection to set proper colors according to system
 
 # Variables
@@ -111,10 +146,668 @@ print("FG/Font Color {}".format(FG_Color))
 print("#DEBUGGING END#")
 
 
+# function to format the statistics of a burst session for the log. The Tx side (BURST) only reports the sent
+# packets. The Rx side only sees the losses up to the highest received sequence number, so if the sent packets of the
+# link are known (sent), the losses are calculated from them and also cover a lost end of the burst.
+def burstStatsText(splitData, sent=None):
+    received, lost, dup, reordered = (int(value) for value in splitData[3:7])
+    if splitData[1] == 'BURST':
+        return "IP: {}, Mode: BURST, Sent: {}, Packets/s: {}, Goodput: {} B/s".format(
+            splitData[0], received, splitData[7], splitData[8])
+    if sent is not None:
+        lost = max(sent - received, 0)
+    loss = 0.0
+    if received + lost > 0:
+        loss = 100.0 * lost / (received + lost)
+    return ("IP: {}, Mode: BURSTRX, Received: {}, Lost: {} ({:.1f} %), Duplicates: {}, Reordered: {}, Packets/s: {}, "
+            "Goodput: {} B/s".format(splitData[0], received, lost, loss, dup, reordered, splitData[7], splitData[8]))
+
+
+# class to write captured LoRa packets to a pcap file with a LoRaTap header, so the capture can be opened with
+# Wireshark. New packets are appended to an existing file, the file is flushed after every packet so it can be read
+# while the capture is still running.
+class CaptureFile:
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab')
+        if new:
+            self.file.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, PCAP_LINKTYPE_LORATAP))
+
+    # function to append one packet, RSSI and SNR are encoded as defined by LoRaTap (-139 dBm offset, 0.25 dB steps)
+    def write(self, timestamp, freq, sf, rssi, snr, payload):
+        header = struct.pack('>BBHIBBBBBbB', 0, 0, 15, freq, 1, sf, min(max(int(rssi) + 139, 0), 255), 0, 0,
+                             min(max(round(snr * 4), -128), 127), LORATAP_SYNC_WORD)
+        seconds = int(timestamp)
+        self.file.write(struct.pack('<IIII', seconds, int((timestamp - seconds) * 1000000),
+                                    len(header) + len(payload), len(header) + len(payload)))
+        self.file.write(header)
+        self.file.write(payload)
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+# function to index a capture file, only the record headers are read. Returns a list with the file offset and the
+# timestamp of every packet which can be used to seek directly to a packet or a point in time
+def indexCaptureFile(path):
+    index = []
+    with open(path, 'rb') as captureFile:
+        offset = 24
+        captureFile.seek(offset)
+        while True:
+            record = captureFile.read(16)
+            if len(record) < 16:
+                break
+            seconds, microseconds, length, _ = struct.unpack('<IIII', record)
+            index.append((offset, seconds + microseconds / 1000000))
+            offset += 16 + length
+            captureFile.seek(offset)
+    return index
+
+
+# class for the NTP like clock synchronisation with the nodes. Every ping round sends a few PING requests over the
+# control channel, the node answers with its receive and transmit time in ms. The sample with the lowest round trip
+# delay of a round gives the clock offset of the node with an error of half this delay. The drift is the slope of the
+# offsets of all rounds of a node, so the nodes should be pinged before and after a measurement.
+class ClockSync:
+    def __init__(self):
+        self.rounds = {}
+        self.lock = threading.Lock()
+
+    # function to return the desktop clock in ms, monotonic so the offsets don't jump with the system time
+    @staticmethod
+    def now():
+        return time.monotonic() * 1000
+
+    # function to ping a node, returns the offset and the error in ms or None if the node didn't answer
+    def ping(self, host, count=8, timeout=2.0):
+        best = None
+        try:
+            with socket.create_connection((host, PORT), timeout=timeout) as connection:
+                reader = connection.makefile('r')
+                for _ in range(count):
+                    t1 = self.now()
+                    connection.sendall("PING:{:.3f}\n".format(t1).encode())
+                    reply = reader.readline().strip().split(":")
+                    t4 = self.now()
+                    if len(reply) != 4 or reply[0] != 'PONG':
+                        break
+                    t2, t3 = float(reply[2]), float(reply[3])
+                    delay = (t4 - t1) - (t3 - t2)
+                    if best is None or delay < best[2]:
+                        best = ((t1 + t4) / 2, ((t2 - t1) + (t3 - t4)) / 2, delay)
+        except OSError:
+            print("Clock sync with node {} failed".format(host))
+        if best is None:
+            print("Clock sync with node {} got no answer".format(host))
+            return None
+        with self.lock:
+            self.rounds.setdefault(host, []).append(best)
+        # the clock of the node has only a resolution of 1 ms
+        return best[1], best[2] / 2 + 1
+
+    # function to return offset at a desktop time, drift in ppm and error in ms of a node, None if never synchronised.
+    # The drift is None if it's not measured yet, it needs two rounds.
+    def estimate(self, host):
+        with self.lock:
+            rounds = list(self.rounds.get(host, []))
+        if not rounds:
+            return None
+        drift = None
+        if len(rounds) > 1:
+            meanTime = sum(r[0] for r in rounds) / len(rounds)
+            meanOffset = sum(r[1] for r in rounds) / len(rounds)
+            spread = sum((r[0] - meanTime) ** 2 for r in rounds)
+            if spread > 0:
+                drift = sum((r[0] - meanTime) * (r[1] - meanOffset) for r in rounds) / spread
+        refTime, refOffset, refDelay = min(rounds, key=lambda r: r[2])
+        return refTime, refOffset, drift, refDelay / 2 + 1
+
+    # function to convert a node timestamp in ms to the desktop clock, returns the time and its error in ms
+    def toLocal(self, host, nodeTime):
+        estimate = self.estimate(host)
+        if estimate is None:
+            return None
+        refTime, refOffset, drift, error = estimate
+        drift = drift or 0.0
+        # node = local + offset + drift * (local - refTime), solved for local
+        return (nodeTime - refOffset + drift * refTime) / (1 + drift), error
+
+
+# function to format the Tx->Rx latencies of a burst link for the log: count, min, median, 95th percentile and max
+def latencyText(txHost, rxHost, latencies, error):
+    latencies = sorted(latencies)
+    return ("Latency {} -> {}: {} packets, min {:.1f} ms, median {:.1f} ms, p95 {:.1f} ms, max {:.1f} ms (+/- {:.1f} ms)"
+            .format(txHost, rxHost, len(latencies), latencies[0], latencies[len(latencies) // 2],
+                    latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], latencies[-1], error))
+
+
+# class for the health state of a single node
+class NodeHealth:
+    def __init__(self, host):
+        self.host = host
+        self.status = 'UNKNOWN'
+        self.lastSeen = None
+        self.job = ''
+        self.heap = 0
+        self.rssi = 0
+        self.uptime = 0
+        self.largest = 0
+        self.jobId = None
+        self.failures = 0
+
+
+# class for the health monitor which sends a STATUS heartbeat to every known node. All heartbeats run as asyncio tasks
+# in one event loop thread, so the cost per node is only one socket per heartbeat and no thread. The start of every
+# node is shifted randomly within the interval to spread the heartbeats evenly.
+# A node is ALIVE if it answers, DEGRADED if it misses one heartbeat or has low heap or WiFi RSSI, UNRESPONSIVE if it
+# accepts the connection without an answer (old firmware or stuck) and DEAD after HEARTBEAT_DEAD missed heartbeats.
+class HealthMonitor:
+    def __init__(self, onChange):
+        self.nodes = {}
+        self.tasks = {}
+        self.onChange = onChange
+        self.semaphore = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.run, name='HealthMonitor', daemon=True).start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.semaphore = asyncio.Semaphore(HEARTBEAT_CONCURRENCY)
+        self.loop.run_forever()
+
+    # function to add a node to the monitor, can be called from any thread
+    def add(self, host):
+        if host in self.nodes:
+            return
+        self.nodes[host] = NodeHealth(host)
+        self.loop.call_soon_threadsafe(self.startWatch, host)
+
+    # function to remove a node from the monitor, can be called from any thread
+    def remove(self, host):
+        if self.nodes.pop(host, None) is not None:
+            self.loop.call_soon_threadsafe(self.stopWatch, host)
+
+    def startWatch(self, host):
+        self.tasks[host] = self.loop.create_task(self.watch(self.nodes[host]))
+
+    def stopWatch(self, host):
+        task = self.tasks.pop(host, None)
+        if task is not None:
+            task.cancel()
+
+    # function to return the current state of all nodes for the GUI
+    def snapshot(self):
+        return list(self.nodes.values())
+
+    async def watch(self, node):
+        await asyncio.sleep(random.uniform(0, HEARTBEAT_INTERVAL))
+        while True:
+            start = self.loop.time()
+            await self.heartbeat(node)
+            await asyncio.sleep(max(0.0, HEARTBEAT_INTERVAL - (self.loop.time() - start)))
+
+    async def heartbeat(self, node):
+        async with self.semaphore:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(node.host, PORT), HEARTBEAT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError):
+                self.update(node, None)
+                return
+            try:
+                writer.write(b'STATUS\n')
+                reply = await asyncio.wait_for(reader.readline(), HEARTBEAT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError):
+                reply = b''
+            finally:
+                writer.close()
+        self.update(node, reply.decode('utf-8', 'replace').strip())
+
+    # function to update the node with the STATUS reply (None if the node was not reachable)
+    # Example for a STATUS reply: STATUS:IDLE:2561344:-61:3600:2490368:0 with job, free heap, WiFi RSSI, uptime in
+    # seconds, the largest free heap block and the id of the scheduled job (both not sent by older firmware)
+    def update(self, node, reply):
+        fields = reply.split(":") if reply else []
+        if len(fields) >= 5 and fields[0] == 'STATUS':
+            try:
+                node.heap, node.rssi, node.uptime = int(fields[2]), int(fields[3]), int(fields[4])
+                node.largest = int(fields[5]) if len(fields) >= 6 else node.heap
+                node.jobId = int(fields[6]) if len(fields) >= 7 else None
+            except ValueError:
+                fields = []
+        if len(fields) >= 5 and fields[0] == 'STATUS':
+            node.failures = 0
+            node.lastSeen = datetime.now()
+            node.job = fields[1]
+            if node.heap < HEAP_LOW or node.largest < HEAP_BLOCK_LOW or node.rssi < RSSI_LOW:
+                status = 'DEGRADED'
+            else:
+                status = 'ALIVE'
+        else:
+            node.failures += 1
+            if reply is not None:
+                status = 'UNRESPONSIVE'
+            elif node.failures >= HEARTBEAT_DEAD:
+                status = 'DEAD'
+            else:
+                status = 'DEGRADED'
+        if status != node.status:
+            previous = node.status
+            node.status = status
+            self.onChange(node, previous)
+
+
+# function to expand the node list of the Nodes tab, the IPs are separated by commas and the last part of an IP can be
+# a range. Example: 192.168.100.10, 192.168.100.20-29
+def expandHosts(text):
+    hosts = []
+    for part in text.split(","):
+        part = part.strip()
+        match = re.match('^((?:\d{1,3}\.){3})(\d{1,3})-(\d{1,3})$', part)
+        if match:
+            hosts.extend(match.group(1) + str(n) for n in range(int(match.group(2)), int(match.group(3)) + 1))
+        elif part:
+            hosts.append(part)
+    return hosts
+
+
+# function to calculate the time on air of a LoRa packet in seconds (explicit header, CRC, 8 symbols preamble)
+def airtime(sf, bw, fec, length):
+    symbolTime = 2 ** sf / (bw * 1000)
+    lowDataRate = 1 if symbolTime > 0.016 else 0
+    codingRate = FEC.index(fec) + 1 if fec in FEC else 1
+    payloadSymbols = 8 + max(math.ceil((8 * length - 4 * sf + 44) / (4 * (sf - 2 * lowDataRate))) * (codingRate + 4), 0)
+    return (12.25 + payloadSymbols) * symbolTime
+
+
+# function to estimate the duration of a job in seconds from its command, None for jobs without end (0 cycles or
+# 0 minutes). Tx takes cycles x (pause + time on air), a burst packets x time on air and all receiving modes the
+# duration. A scan can end earlier as it goes on with the next step after a received packet.
+def estimateDuration(message):
+    fields = message.split(":")
+    try:
+        mode, sf, repeat = fields[0], int(fields[1]), int(fields[5])
+        if mode == 'SCAN':
+            return SCAN_DURATION
+        if mode in ('TX', 'BURST'):
+            packet = airtime(sf, int(fields[2]), fields[7], len(fields[8].encode()) + (6 if mode == 'BURST' else 0))
+            if mode == 'BURST':
+                return (repeat if repeat > 0 else 65536) * packet
+            return repeat * (int(fields[6]) + packet) if repeat > 0 else None
+        return repeat * 60 if repeat > 0 else None
+    except (IndexError, ValueError):
+        return None
+
+
+# class for a job of the scheduler
+class Job:
+    def __init__(self, jobId, host, message, priority):
+        self.jobId = jobId
+        self.host = host
+        self.message = message
+        self.mode = message.split(":")[0]
+        self.priority = priority
+        self.duration = estimateDuration(message)
+        self.state = 'QUEUED'
+        self.started = None
+        self.acked = False
+        self.timer = None
+
+
+# class for the job scheduler which keeps an ordered queue for every node. A node can only run one job at a time, so
+# the next job is sent as soon as the node reports the END of the running one. Jobs with a higher priority (lower
+# number) are sent first, jobs with the same priority in the order they were added. The job id is appended to the
+# command and echoed by the node in its START and END replies, so only the END of the running job finishes it. Older
+# firmware without the id needs an END of the same mode after the START of the job.
+# Jobs without END (0 cycles or 0 minutes) block the queue of their node until they are cancelled. A cancelled running
+# job is aborted on the node and waits for its END. A job without END reply is checked JOB_GRACE seconds after its
+# estimated end, it's treated as finished unless the node still reports it in its STATUS reply.
+class JobScheduler:
+    def __init__(self, dispatch, onChange, abort, busy):
+        self.dispatch = dispatch
+        self.onChange = onChange
+        self.abort = abort
+        self.busy = busy
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.running = {}
+        self.jobs = {}
+        self.counter = itertools.count(1)
+
+    # function to add a job, returns the job id
+    def submit(self, host, message, priority=1):
+        with self.lock:
+            job = Job(next(self.counter), host, message, priority)
+            self.jobs[job.jobId] = job
+            heapq.heappush(self.queues.setdefault(host, []), (priority, job.jobId, job))
+        self.onChange(job)
+        self.dispatchNext(host)
+        return job.jobId
+
+    # function to send the next job of a node if the node is free
+    def dispatchNext(self, host):
+        with self.lock:
+            queue = self.queues.get(host, [])
+            while queue and queue[0][2].state == 'CANCELLED':
+                heapq.heappop(queue)
+            if host in self.running or not queue:
+                return
+            job = heapq.heappop(queue)[2]
+            job.state = 'RUNNING'
+            job.started = time.time()
+            self.running[host] = job
+            if job.duration is not None:
+                self.startTimer(job, job.duration + JOB_GRACE)
+        self.onChange(job)
+        threading.Thread(target=self.run, args=(job,), daemon=True).start()
+
+    def run(self, job):
+        if not self.dispatch(job.host, job.message + str(job.jobId)):
+            self.end(job, 'FAILED')
+
+    def startTimer(self, job, delay):
+        if job.timer is not None:
+            job.timer.cancel()
+        job.timer = threading.Timer(delay, self.timeout, (job,))
+        job.timer.daemon = True
+        job.timer.start()
+
+    # function to return the running job of a node if it matches the id or the mode of a reply (id None)
+    def runningJob(self, host, mode, jobId):
+        job = self.running.get(host)
+        if job is None or (job.jobId != jobId if jobId is not None else job.mode != mode):
+            return None
+        return job
+
+    # function to mark the running job of a node as started, called on START
+    def start(self, host, mode, jobId=None):
+        with self.lock:
+            job = self.runningJob(host, mode, jobId)
+            if job is not None:
+                job.acked = True
+
+    # function to finish the running job of a node, called on END. An END which doesn't belong to it is ignored.
+    def finish(self, host, mode, jobId=None):
+        with self.lock:
+            job = self.runningJob(host, mode, jobId)
+            if job is None or (jobId is None and not job.acked):
+                return
+        self.end(job, 'CANCELLED' if job.state == 'CANCELLING' else 'DONE')
+
+    # function to remove a running job with its final state and send the next one
+    def end(self, job, state):
+        with self.lock:
+            if self.running.get(job.host) is not job:
+                return
+            del self.running[job.host]
+            job.state = state
+            if job.timer is not None:
+                job.timer.cancel()
+            del self.jobs[job.jobId]
+        self.onChange(job)
+        self.dispatchNext(job.host)
+
+    def timeout(self, job):
+        if self.running.get(job.host) is not job:
+            return
+        if self.busy(job.host, job.jobId):
+            self.startTimer(job, JOB_GRACE)
+            if job.state == 'CANCELLING':
+                self.abort(job.host, job.jobId)
+        else:
+            self.end(job, 'CANCELLED' if job.state == 'CANCELLING' else 'TIMEOUT')
+
+    # function to cancel a job. A queued job is removed from the queue, a running one is aborted on the node and
+    # ends with its END reply. Cancelling a job which is already being aborted removes it without waiting.
+    def cancel(self, jobId):
+        with self.lock:
+            job = self.jobs.get(jobId)
+            if job is None:
+                return
+            previous = job.state
+            if job.state == 'QUEUED':
+                job.state = 'CANCELLED'
+                del self.jobs[jobId]
+            elif job.state == 'RUNNING':
+                job.state = 'CANCELLING'
+                self.startTimer(job, JOB_GRACE)
+        if previous == 'QUEUED':
+            self.onChange(job)
+        elif previous == 'RUNNING':
+            self.onChange(job)
+            threading.Thread(target=self.abort, args=(job.host, job.jobId), daemon=True).start()
+        else:
+            self.end(job, 'CANCELLED')
+
+    # function to return all running and queued jobs with their estimated start and end time, None if unknown
+    def schedule(self):
+        result = []
+        with self.lock:
+            for host in sorted(set(self.queues) | set(self.running)):
+                end = time.time()
+                job = self.running.get(host)
+                if job is not None:
+                    end = job.started + job.duration if job.duration is not None else None
+                    result.append((job, job.started, end))
+                for _, _, job in sorted(self.queues.get(host, [])):
+                    if job.state != 'QUEUED':
+                        continue
+                    start = end
+                    end = start + job.duration if start is not None and job.duration is not None else None
+                    result.append((job, start, end))
+        return result
+
+
+# class to record every data block received by the port 4711 listener with the monotonic time since the start of the
+# recording, the number of the connection and the source address. An empty block marks the end of a connection.
+class FrameRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.start = time.monotonic_ns()
+        self.file = open(path, 'wb')
+        self.file.write(RECORD_MAGIC)
+
+    def write(self, connection, address, data):
+        with self.lock:
+            self.file.write(RECORD_HEADER.pack(time.monotonic_ns() - self.start, connection,
+                                               socket.inet_aton(address[0]), address[1], len(data)))
+            self.file.write(data)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+# function to read a listener recording, yields time in ns, connection, source address and data of every block
+def readRecording(path):
+    with open(path, 'rb') as recording:
+        if recording.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+            raise ValueError('{} is no listener recording'.format(path))
+        while True:
+            header = recording.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            timestamp, connection, ip, port, length = RECORD_HEADER.unpack(header)
+            yield timestamp, connection, (socket.inet_ntoa(ip), port), recording.read(length)
+
+
+# function to replay a listener recording at the given speed, 1 is the recorded speed, 10 ten times faster and 0 as
+# fast as possible. The target is either an App, then the blocks are fed into its frame parser without the live side
+# effects, or a (host, port) tuple of a running listener, then every recorded connection is opened again and the
+# blocks are sent.
+def replayRecording(path, target, speed=1.0):
+    connections = {}
+    start = time.monotonic_ns()
+    count = 0
+    for timestamp, connection, address, data in readRecording(path):
+        if speed > 0:
+            delay = (start + timestamp / speed - time.monotonic_ns()) / 1e9
+            if delay > 0:
+                time.sleep(delay)
+        if isinstance(target, tuple):
+            if connection not in connections:
+                connections[connection] = socket.create_connection(target)
+            if data:
+                connections[connection].sendall(data)
+            else:
+                connections.pop(connection).close()
+        else:
+            rest = target.handleData(connections.pop(connection, b''), data, live=False)
+            if data:
+                connections[connection] = rest
+            elif rest:
+                target.parseFrame(rest.decode('utf-8', 'replace'), live=False)
+        count += 1
+    if isinstance(target, tuple):
+        for clientSocket in connections.values():
+            clientSocket.close()
+    print('Replay of {} finished: {} blocks in {:.1f} seconds'.format(path, count, (time.monotonic_ns() - start) / 1e9))
+    return count
+
+
+# class for a timing span which is written as complete event to the trace
+class TraceSpan:
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.profiler.addEvent({'name': self.name, 'ph': 'X', 'ts': self.start // 1000,
+                                'dur': (end - self.start) // 1000, 'args': self.args})
+
+
+# class for the built-in instrumentation which can be switched on and off at runtime with --profile, SIGUSR1 or the
+# hidden menu (Ctrl+Shift+P). While running it collects
+# - timing spans of the hot paths, exported in the Chrome trace event format (chrome://tracing, Perfetto)
+# - stack samples of all threads, exported as folded stacks (flamegraph.pl, speedscope)
+# - tracemalloc snapshots, exported as difference to the previous dump
+# Without instrumentation span() only returns a shared empty context, so the hot paths stay nearly as fast as before.
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.events = collections.deque(maxlen=TRACE_EVENTS)
+        self.samples = collections.Counter()
+        self.snapshot = None
+        # tracemalloc is only stopped again if the profiler started it
+        self.ownTracing = False
+        self.noSpan = contextlib.nullcontext()
+
+    # function to return a timing span for a with statement
+    def span(self, name, **args):
+        if not self.enabled:
+            return self.noSpan
+        return TraceSpan(self, name, args)
+
+    # functions to mark the begin and end of an asynchronous span, e.g. a command until the node acknowledges it
+    def asyncBegin(self, name, spanId, **args):
+        if self.enabled:
+            self.addEvent({'name': name, 'ph': 'b', 'cat': name, 'id': spanId,
+                           'ts': time.perf_counter_ns() // 1000, 'args': args})
+
+    def asyncEnd(self, name, spanId):
+        if self.enabled:
+            self.addEvent({'name': name, 'ph': 'e', 'cat': name, 'id': spanId, 'ts': time.perf_counter_ns() // 1000})
+
+    def addEvent(self, event):
+        event['pid'] = os.getpid()
+        event['tid'] = threading.get_ident()
+        self.events.append(event)
+
+    def start(self):
+        with self.lock:
+            if self.enabled:
+                return
+            self.enabled = True
+            self.ownTracing = not tracemalloc.is_tracing()
+            if self.ownTracing:
+                tracemalloc.start()
+            self.snapshot = tracemalloc.take_snapshot()
+            threading.Thread(target=self.sample, name='Profiler', daemon=True).start()
+        print('Profiling started')
+
+    # function to stop the instrumentation, everything collected so far is written to the dump files
+    def stop(self):
+        with self.lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+        self.dump()
+        if self.ownTracing:
+            tracemalloc.stop()
+            self.ownTracing = False
+        print('Profiling stopped')
+
+    def toggle(self):
+        if self.enabled:
+            self.stop()
+        else:
+            self.start()
+
+    # function of the sampling thread, records the stack of every other thread
+    def sample(self):
+        own = threading.get_ident()
+        while self.enabled:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append('{} ({}:{})'.format(frame.f_code.co_name, os.path.basename(frame.f_code.co_filename),
+                                                     frame.f_lineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(PROFILE_INTERVAL)
+
+    # function to write the trace, the profile and the memory difference since the last dump, returns the file prefix
+    def dump(self):
+        prefix = 'LoRaProfile_{}'.format(datetime.now().strftime("%Y%m%d_%H%M%S"))
+        events = list(self.events)
+        for thread in threading.enumerate():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread.ident,
+                           'args': {'name': thread.name}})
+        with open(prefix + '.trace.json', 'w') as traceFile:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, traceFile)
+        with open(prefix + '.folded', 'w') as profileFile:
+            for stack, count in self.samples.most_common():
+                profileFile.write('{} {}\n'.format(stack, count))
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            with open(prefix + '.memory.txt', 'w') as memoryFile:
+                if self.snapshot is not None:
+                    for stat in snapshot.compare_to(self.snapshot, 'lineno')[:50]:
+                        memoryFile.write('{}\n'.format(stat))
+            self.snapshot = snapshot
+        self.events.clear()
+        self.samples.clear()
+        print('Profile written to {}.*'.format(prefix))
+        return prefix
+
+
+PROFILER = Profiler()
+
+
 # main class for this GUI application
 class App(tk.Tk):
-    def __init__(self):
+    def __init__(self, recorder=None):
         super().__init__()
+        # optional recorder of all data received by the listener
+        self.recorder = recorder
         self.comboGqrxFQ = None
         self.textBoxHelp = None
         self.sliderRxDuration = None
@@ -135,6 +828,28 @@ class App(tk.Tk):
         self.comboTxBW = None
         self.comboTxSF = None
         self.comboTxFQ = None
+        # open capture files per node IP
+        self.captureFiles = {}
+        self.captureLock = threading.Lock()
+        # clock synchronisation and the burst timestamps for the Tx->Rx latency
+        self.clockSync = ClockSync()
+        self.burstTxHosts = {}
+        self.burstRxMsgs = {}
+        self.burstStamps = {}
+        # sent packets of the last burst of a Tx node and the last statistics of a burst Rx node
+        self.burstSent = {}
+        self.burstReceived = {}
+        # health monitor for all known nodes and the rows of the Nodes tab
+        self.healthMonitor = HealthMonitor(self.nodeChanged)
+        self.treeNodes = None
+        self.textBoxNodes = None
+        self.nodeRows = {}
+        self.jobRows = {}
+        # job scheduler with a queue for every node
+        self.jobScheduler = JobScheduler(self.dispatchJob, self.jobChanged, self.abortJob, self.jobBusy)
+        self.treeJobs = None
+        self.comboTxPrio = None
+        self.comboRxPrio = None
         # Application window resolution
         self.geometry('500x400')
         # Background color
@@ -148,8 +863,10 @@ class App(tk.Tk):
         self.tabHelp = ttk.Frame(self.tabController)
         self.tabLog = ttk.Frame(self.tabController)
         self.tabTools = ttk.Frame(self.tabController)
+        self.tabNodes = ttk.Frame(self.tabController)
         self.tabController.add(self.tabTx, text='Tx')
         self.tabController.add(self.tabRx, text='Rx')
+        self.tabController.add(self.tabNodes, text='Nodes')
         self.tabController.add(self.tabHelp, text='Help')
         self.tabController.add(self.tabLog, text='Log')
         # self.tabController.add(self.tabTools, text='Tools') # to be deactivated after taking screenshots
@@ -176,49 +893,105 @@ class App(tk.Tk):
         self.create_sliders_Rx()
         self.create_buttons_Tx()
         self.create_buttons_Rx()
+        self.create_nodes_tab()
         # self.create_tools_tab() #to be deactivated after taking screenshots
         # If Linux, create the content for the Tools tab
         if OS == "Linux":
             self.create_tools_tab()
         # Start the background listener
         self.handle_listener()
+        # hidden menu for the profiler
+        self.bind('<Control-P>', self.showProfilerMenu)
         # Write the first log entry in case everything started normally
         self.logEntry('Application started')
 
+    # function to open the hidden profiler menu with Ctrl+Shift+P
+    def showProfilerMenu(self, event):
+        menu = tk.Menu(self, tearoff=0)
+        menu.add_command(label='Stop profiling' if PROFILER.enabled else 'Start profiling', command=self.toggleProfiler)
+        menu.add_command(label='Write profile', command=self.dumpProfiler)
+        menu.tk_popup(event.x_root, event.y_root)
+
+    def toggleProfiler(self):
+        PROFILER.toggle()
+        self.logEntry('Profiling {}'.format('started' if PROFILER.enabled else 'stopped'))
+
+    def dumpProfiler(self):
+        if PROFILER.enabled:
+            self.logEntry('Profile written to {}.*'.format(PROFILER.dump()))
+
     # function to write a log entry
     def logEntry(self, text):
-        self.textBoxLog.configure(state='normal')
-        self.textBoxLog.insert(tkinter.INSERT, datetime.now().strftime("%Y/%m/%d, %H:%M:%S"))
-        self.textBoxLog.insert(tkinter.INSERT, ' - ')
-        self.textBoxLog.insert(tkinter.INSERT, text)
-        self.textBoxLog.insert(tkinter.INSERT, "\n")
-        self.textBoxLog.insert(tkinter.INSERT, "-------------------------------------")
-        self.textBoxLog.insert(tkinter.INSERT, "\n")
-        self.textBoxLog.configure(state='disabled')
+        with PROFILER.span('frame.display'):
+            self.textBoxLog.configure(state='normal')
+            self.textBoxLog.insert(tkinter.INSERT, datetime.now().strftime("%Y/%m/%d, %H:%M:%S"))
+            self.textBoxLog.insert(tkinter.INSERT, ' - ')
+            self.textBoxLog.insert(tkinter.INSERT, text)
+            self.textBoxLog.insert(tkinter.INSERT, "\n")
+            self.textBoxLog.insert(tkinter.INSERT, "-------------------------------------")
+            self.textBoxLog.insert(tkinter.INSERT, "\n")
+            self.textBoxLog.configure(state='disabled')
 
     # function for new outbound socket connection
+    # the clock of the node is synchronised before a burst so the latency can be calculated afterwards
     def startService(self, host, port, message):
+        if port == PORT:
+            self.healthMonitor.add(host)
+        if port == PORT and message.startswith('BURST'):
+            self.clockSync.ping(host)
         try:
-            clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            clientSocket.connect((host, port))
-            clientSocket.send(message.encode())
-            clientSocket.close()
+            with PROFILER.span('command.send', host=host):
+                clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                clientSocket.connect((host, port))
+                clientSocket.send(message.encode())
+                clientSocket.close()
+            # the START reply of the node acknowledges the command, other services like Gqrx don't reply
+            if port == PORT:
+                PROFILER.asyncBegin('command.ack', host, command=message.split(":")[0])
+            return True
         except TimeoutError:
             print('Target not found, Timeout.')
         except OSError:
             print("Network is unreachable")
             self.logEntry("ERROR: Network is unreachable for node {}".format(host))
+        return False
+
+    # function of the job scheduler to send a job to a node
+    def dispatchJob(self, host, message):
+        return self.startService(host, PORT, message)
+
+    # function of the job scheduler to abort the running job of a node, the node answers with the END of the job
+    def abortJob(self, host, jobId):
+        try:
+            with socket.create_connection((host, PORT), timeout=HEARTBEAT_TIMEOUT) as clientSocket:
+                clientSocket.send("ABORT:{}".format(jobId).encode())
+        except OSError:
+            self.logEntry("ERROR: Abort of job {} failed, node {} is unreachable".format(jobId, host))
+
+    # function of the job scheduler to check if a node still runs a job, by the last STATUS reply of the node
+    def jobBusy(self, host, jobId):
+        node = self.healthMonitor.nodes.get(host)
+        return (node is not None and node.jobId == jobId and node.lastSeen is not None
+                and (datetime.now() - node.lastSeen).total_seconds() < HEARTBEAT_INTERVAL * HEARTBEAT_DEAD)
+
+    # function called by the job scheduler if the state of a job changed
+    def jobChanged(self, job):
+        self.logEntry("Job {} on IP {}: {} {}".format(job.jobId, job.host, job.mode, job.state))
 
     # function to return the Tx infos in a formatted way + log entry
-    def getTxString(self):
-        data = ("TX:" + str(self.comboTxSF.get()) + ":" + str(self.comboTxBW.get()) + ":" + str(
+    def getTxString(self, mode='TX'):
+        with PROFILER.span('command.build', mode=mode):
+            return self.buildTxString(mode)
+
+    def buildTxString(self, mode):
+        data = (str(mode) + ":" + str(self.comboTxSF.get()) + ":" + str(self.comboTxBW.get()) + ":" + str(
             self.comboTxFQ.get()) + ":"
                 + str(self.comboTxTXP.get()) + ":" + str(self.sliderTxCycles.get()) + ":" + str(
                     self.sliderTxPause.get()) + ":"
                 + str(self.comboTxFEC.get()) + ":" + str(self.textBoxTxMSG.get()) + ":")
         self.logEntry(
-            'Tx on IP {} with Msg: {} - {} MHz, SF {}, {} kHz BW, {} FEC, {} watt, {} cycles and {} seconds pause'
-                .format(str(self.textBoxTxIP.get()), str(self.textBoxTxMSG.get()),
+            '{} on IP {} with Msg: {} - {} MHz, SF {}, {} kHz BW, {} FEC, {} watt, {} cycles and {} seconds pause'
+                .format(mode, str(self.textBoxTxIP.get()), str(self.textBoxTxMSG.get()),
                         str(self.comboTxFQ.get())[0:3],
                         str(self.comboTxSF.get()),
                         str(self.comboTxBW.get()), str(self.comboTxFEC.get()), str(self.comboTxTXP.get()),
@@ -230,6 +1003,10 @@ class App(tk.Tk):
 
     # function to return the Rx infos in a formatted way + log entry
     def getRxString(self, mode):
+        with PROFILER.span('command.build', mode=mode):
+            return self.buildRxString(mode)
+
+    def buildRxString(self, mode):
         data = (str(mode) + ":" + str(self.comboRxSF.get()) + ":noBW:" + str(self.comboRxFQ.get()) + ":noPower:" +
                 str(self.sliderRxDuration.get()) + ":noCycles:noFEC:" + str(self.textBoxRxMSG.get()) + ":")
         self.logEntry('{} on IP {} with Msg: {} - {} MHz, SF {} for {} minutes (0 minutes = infinite)'
@@ -241,33 +1018,39 @@ class App(tk.Tk):
         print(data)
         return data
 
-    # Function for the Tx Button which starts a new thread with the startService function
+    # Function for the Tx Button which adds a job to the queue of the node
     def btnTxFunction(self):
         print('Button Tx clicked')
-        thread = threading.Thread(target=self.startService, args=(self.textBoxTxIP.get(), PORT, self.getTxString()))
-        try:
-            thread.start()
-        except OSError:
-            print('OSError')
+        self.jobScheduler.submit(self.textBoxTxIP.get(), self.getTxString(), PRIO.index(self.comboTxPrio.get()))
+
+    # Function for the Burst Button which adds a job to the queue of the node
+    # the cycles are used as the number of packets which are sent without any pause
+    def btnTxBurstFunction(self):
+        print('Button Burst clicked')
+        self.burstTxHosts[self.textBoxTxMSG.get()] = self.textBoxTxIP.get()
+        self.jobScheduler.submit(self.textBoxTxIP.get(), self.getTxString('BURST'), PRIO.index(self.comboTxPrio.get()))
 
-    # Function for the Rx Button which starts a new thread with the startService function
+    # Function for the Rx Button which adds a job to the queue of the node
     def btnRxFunction(self):
         print('Button Rx clicked')
-        thread = threading.Thread(target=self.startService, args=(self.textBoxRxIP.get(), PORT, self.getRxString('RX')))
-        try:
-            thread.start()
-        except OSError:
-            print('OSError')
+        self.jobScheduler.submit(self.textBoxRxIP.get(), self.getRxString('RX'), PRIO.index(self.comboRxPrio.get()))
 
-    # Function for the Scan Button which starts a new thread with the startService function
+    # Function for the Scan Button which adds a job to the queue of the node
     def btnRxScanFunction(self):
         print('Button Scan clicked')
-        thread = threading.Thread(target=self.startService,
-                                  args=(self.textBoxRxIP.get(), PORT, self.getRxString('SCAN')))
-        try:
-            thread.start()
-        except OSError:
-            print('OSError')
+        self.jobScheduler.submit(self.textBoxRxIP.get(), self.getRxString('SCAN'), PRIO.index(self.comboRxPrio.get()))
+
+    # Function for the Burst-Rx Button which adds a job to the queue of the node
+    def btnRxBurstFunction(self):
+        print('Button Burst-Rx clicked')
+        self.burstRxMsgs[self.textBoxRxIP.get()] = self.textBoxRxMSG.get()
+        self.jobScheduler.submit(self.textBoxRxIP.get(), self.getRxString('BURSTRX'), PRIO.index(self.comboRxPrio.get()))
+
+    # Function for the Capture Button which adds a job to the queue of the node
+    # the message is used as prefix filter, several prefixes are separated by | and an empty message or * captures all
+    def btnRxCaptureFunction(self):
+        print('Button Capture clicked')
+        self.jobScheduler.submit(self.textBoxRxIP.get(), self.getRxString('CAPTURE'), PRIO.index(self.comboRxPrio.get()))
 
     # Button functions for setting Gqrx parameters
     def btnGqrxFunction(self):
@@ -300,6 +1083,8 @@ class App(tk.Tk):
             grid(row=7, column=0, padx='10', pady='5')
         Label(self.tabTx, text='Transmit Cycles:', bg=BG_Color, fg=FG_Color, font=('arial', 12, 'normal')). \
             grid(row=8, column=0, padx='10', pady='5')
+        Label(self.tabTx, text='Priority:', bg=BG_Color, fg=FG_Color, font=('arial', 12, 'normal')). \
+            grid(row=9, column=0, padx='10', pady='5')
 
     # function to create a warning label in case of network problems
     def create_label_warning(self):
@@ -318,6 +1103,8 @@ class App(tk.Tk):
             grid(row=3, column=0, padx='15', pady='5')
         Label(self.tabRx, text='Scan duration:', bg=BG_Color, fg=FG_Color, font=('arial', 12, 'normal')). \
             grid(row=4, column=0, padx='15', pady='5')
+        Label(self.tabRx, text='Priority:', bg=BG_Color, fg=FG_Color, font=('arial', 12, 'normal')). \
+            grid(row=5, column=0, padx='15', pady='5')
 
     # Function to create the comboboxes on the Tx tab
     def create_comboboxes_Tx(self):
@@ -354,6 +1141,12 @@ class App(tk.Tk):
         self.comboTxTXP.grid(row=6, column=1)
         self.comboTxTXP.current(11)
 
+        self.comboTxPrio = ttk.Combobox(self.tabTx, values=PRIO, font=('arial', 12, 'normal'), width=24,
+                                        background=BG_Color,
+                                        state="readonly")
+        self.comboTxPrio.grid(row=9, column=1)
+        self.comboTxPrio.current(1)
+
     # Function to create the comboboxes on the Rx tab
     def create_comboboxes_Rx(self):
         self.comboRxFQ = ttk.Combobox(self.tabRx, values=FREQ, font=('arial', 12, 'normal'), width=24,
@@ -369,6 +1162,12 @@ class App(tk.Tk):
         self.comboRxSF.grid(row=3, column=1)
         self.comboRxSF.current(4)
 
+        self.comboRxPrio = ttk.Combobox(self.tabRx, values=PRIO, font=('arial', 12, 'normal'), width=24,
+                                        background=BG_Color,
+                                        state="readonly")
+        self.comboRxPrio.grid(row=5, column=1)
+        self.comboRxPrio.current(1)
+
     # Function to create the textboxes on the Tx tab
     def create_textboxes_Tx(self):
         self.textBoxTxIP = Entry(self.tabTx, textvariable=StringVar(self, value='192.168.100.100'), width=20)
@@ -438,6 +1237,31 @@ class App(tk.Tk):
                                                 "frequency and SF that all the other nearby LoRa ICs are sending.\n"
                                                 "For further analyzing you can use a RTL SDR and an application like "
                                                 "GQRX to visualize all the LoRa traffic.")
+        self.textBoxHelp.insert(tkinter.INSERT, "\n")
+        self.textBoxHelp.insert(tkinter.INSERT, "-------------------------------------")
+        self.textBoxHelp.insert(tkinter.INSERT, "\n")
+        self.textBoxHelp.insert(tkinter.INSERT, "How can I see all the LoRa traffic with the Microcontroller?")
+        self.textBoxHelp.insert(tkinter.INSERT, "\n \n")
+        self.textBoxHelp.insert(tkinter.INSERT, "The Capture button on the Rx tab forwards every received packet with "
+                                                "RSSI and SNR. The message is used as filter, only packets starting "
+                                                "with it are forwarded. Several filters are separated by | and hex "
+                                                "bytes can be given with 0x, e.g. LoRa|0x4c6f. Leave the message empty "
+                                                "or use * to capture everything.\n"
+                                                "The packets are saved as LoRaCapture_<IP>_<date>.pcap in the "
+                                                "application folder and can be opened with Wireshark.")
+        self.textBoxHelp.insert(tkinter.INSERT, "\n")
+        self.textBoxHelp.insert(tkinter.INSERT, "-------------------------------------")
+        self.textBoxHelp.insert(tkinter.INSERT, "\n")
+        self.textBoxHelp.insert(tkinter.INSERT, "What happens if I start a new job while the Microcontroller is busy?")
+        self.textBoxHelp.insert(tkinter.INSERT, "\n \n")
+        self.textBoxHelp.insert(tkinter.INSERT, "Every Microcontroller has its own queue. A new job waits until the "
+                                                "running one has ended and is sent right after it. Jobs with a higher "
+                                                "priority are sent first. The Nodes tab shows all jobs with their "
+                                                "estimated start and end, queued and running jobs can be cancelled "
+                                                "there. A running job is aborted on the Microcontroller without a "
+                                                "reset and the next job starts after it.\n"
+                                                "Jobs with 0 cycles or 0 minutes never end, they block the queue "
+                                                "until they are cancelled.")
         self.textBoxHelp.configure(state='disabled')
 
     # Function to create the log textbox
@@ -464,12 +1288,18 @@ class App(tk.Tk):
     # Function to create the button on the Tx tab
     def create_buttons_Tx(self):
         Button(self.tabTx, text='Start Tx', font=('arial', 12, 'normal'), command=self.btnTxFunction).grid(pady='10')
+        Button(self.tabTx, text='Burst-Mode', font=('arial', 12, 'normal'), command=self.btnTxBurstFunction). \
+            grid(row=10, column=1, pady='10')
 
     # Function to create the buttons on the Rx tab
     def create_buttons_Rx(self):
         Button(self.tabRx, text='Start Rx', font=('arial', 12, 'normal'), command=self.btnRxFunction).grid(pady='10')
         Button(self.tabRx, text='Scan-Mode', font=('arial', 12, 'normal'), command=self.btnRxScanFunction). \
             grid(pady='10')
+        Button(self.tabRx, text='Burst-Rx', font=('arial', 12, 'normal'), command=self.btnRxBurstFunction). \
+            grid(pady='10')
+        Button(self.tabRx, text='Capture', font=('arial', 12, 'normal'), command=self.btnRxCaptureFunction). \
+            grid(pady='10')
 
     # Function to create the content on the tools tab which is only visible with a Linux OS
     def create_tools_tab(self):
@@ -487,6 +1317,79 @@ class App(tk.Tk):
         Button(self.tabTools, text='Submit', font=('arial', 12, 'normal'), command=self.btnGqrxFunction). \
             grid(row=2, column=1, padx='10')
 
+    # Function to create the content on the nodes tab with the state of the health monitor
+    def create_nodes_tab(self):
+        Label(self.tabNodes, text='IP addresses:', bg=BG_Color, fg=FG_Color, font=('arial', 12, 'normal')). \
+            grid(row=0, column=0, padx='10', pady='10')
+        self.textBoxNodes = Entry(self.tabNodes, textvariable=StringVar(self, value='192.168.100.100'), width=20)
+        self.textBoxNodes.grid(row=0, column=1)
+        Button(self.tabNodes, text='Add', font=('arial', 12, 'normal'), command=self.btnNodesAddFunction). \
+            grid(row=0, column=2, padx='10')
+        columns = ('status', 'job', 'seen', 'heap', 'largest', 'rssi', 'uptime')
+        self.treeNodes = ttk.Treeview(self.tabNodes, columns=columns, height=7)
+        self.treeNodes.heading('#0', text='IP')
+        for column, text in zip(columns, ('Status', 'Job', 'Last seen', 'Free heap', 'Largest block', 'RSSI', 'Uptime')):
+            self.treeNodes.heading(column, text=text)
+            self.treeNodes.column(column, width=60)
+        self.treeNodes.column('#0', width=110)
+        self.treeNodes.grid(row=1, column=0, columnspan=3, sticky='NSEW')
+        columns = ('ip', 'mode', 'priority', 'state', 'start', 'end')
+        self.treeJobs = ttk.Treeview(self.tabNodes, columns=columns, height=5)
+        self.treeJobs.heading('#0', text='Job')
+        for column, text in zip(columns, ('IP', 'Mode', 'Priority', 'State', 'Est. start', 'Est. end')):
+            self.treeJobs.heading(column, text=text)
+            self.treeJobs.column(column, width=70)
+        self.treeJobs.column('#0', width=50)
+        self.treeJobs.grid(row=2, column=0, columnspan=3, sticky='NSEW')
+        Button(self.tabNodes, text='Cancel job', font=('arial', 12, 'normal'), command=self.btnJobCancelFunction). \
+            grid(row=3, column=2, padx='10', pady='5')
+        self.tabNodes.grid_rowconfigure(1, weight=1)
+        self.tabNodes.grid_rowconfigure(2, weight=1)
+        self.tabNodes.grid_columnconfigure(1, weight=1)
+        self.refreshNodes()
+
+    # Function for the Add Button on the nodes tab
+    def btnNodesAddFunction(self):
+        for host in expandHosts(self.textBoxNodes.get()):
+            self.healthMonitor.add(host)
+
+    # function to refresh the nodes tab every second, only the changed rows are updated
+    def refreshNodes(self):
+        for node in self.healthMonitor.snapshot():
+            values = (node.status, node.job, node.lastSeen.strftime("%H:%M:%S") if node.lastSeen else '-',
+                      node.heap, node.largest, node.rssi, node.uptime)
+            if node.host not in self.nodeRows:
+                self.treeNodes.insert('', 'end', iid=node.host, text=node.host, values=values)
+            elif self.nodeRows[node.host] != values:
+                self.treeNodes.item(node.host, values=values)
+            self.nodeRows[node.host] = values
+        # the job rows are updated the same way, so the selection is kept, and finished jobs are removed
+        jobRows = {}
+        for index, (job, start, end) in enumerate(self.jobScheduler.schedule()):
+            values = (job.host, job.mode, PRIO[job.priority], job.state,
+                      datetime.fromtimestamp(start).strftime("%H:%M:%S") if start else '-',
+                      datetime.fromtimestamp(end).strftime("%H:%M:%S") if end else '-')
+            if job.jobId not in self.jobRows:
+                self.treeJobs.insert('', 'end', iid=str(job.jobId), text=str(job.jobId), values=values)
+            elif self.jobRows[job.jobId] != values:
+                self.treeJobs.item(str(job.jobId), values=values)
+            self.treeJobs.move(str(job.jobId), '', index)
+            jobRows[job.jobId] = values
+        for jobId in set(self.jobRows) - set(jobRows):
+            self.treeJobs.delete(str(jobId))
+        self.jobRows = jobRows
+        self.after(1000, self.refreshNodes)
+
+    # Function for the Cancel Button on the nodes tab, cancels the selected jobs
+    def btnJobCancelFunction(self):
+        for jobId in self.treeJobs.selection():
+            self.jobScheduler.cancel(int(jobId))
+
+    # function called by the health monitor if the state of a node changed
+    def nodeChanged(self, node, previous):
+        if node.status in ('DEAD', 'DEGRADED', 'UNRESPONSIVE') or previous not in ('UNKNOWN', 'ALIVE'):
+            self.logEntry("Node {} is {} (was {})".format(node.host, node.status, previous))
+
     # function to start a thread for the socket listener
     def handle_listener(self):
         threading.Thread(target=self.ListenerDaemonFunc, name='Daemon', daemon=True).start()
@@ -499,31 +1402,165 @@ class App(tk.Tk):
         except OSError:
             print("Failed to start GQRX")
 
+    # function to split the data of a connection into frames, as a capture stream sends many frames over one connection.
+    # Returns the incomplete rest which is put in front of the next data
+    def handleData(self, buffer, data, live=True):
+        with PROFILER.span('frame.receive', size=len(data)):
+            *lines, buffer = (buffer + data).split(b'\n')
+            for line in lines:
+                self.parseFrame(line.decode('utf-8', 'replace'), live)
+        return buffer
+
+    # function to check a single frame received by the listener and write the log entry or capture. Replayed frames
+    # (live False) are only logged and displayed, they don't start heartbeats, clock synchronisations or captures and
+    # don't finish jobs of the scheduler, as the recorded nodes might be the real ones.
+    def parseFrame(self, decoded_data, live=True):
+        with PROFILER.span('frame.parse'):
+            self.checkFrame(decoded_data, live)
+
+    def checkFrame(self, decoded_data, live=True):
+        print(decoded_data)
+        # Regex to check if the message is a specific format. Example: 192.168.100.10:TX:START:868000000:11
+        # First part is the IP, second the mode (TX, RX or SCAN), third part the status (START, END or SUCCESS)
+        # and the fourth and fifth part is used for successful scans/receives to submit the frequency and spreading
+        # factor.
+        # A scheduled job adds its id as sixth part, so the replies of an older job don't change the running one.
+        if re.match('^(?:\d{1,3}\.){3}\d{1,3}:(TX|RX|SCAN|BURST|BURSTRX|CAPTURE):(START|END|SUCCESS):\d{1,10}:\d{1,10}'
+                    '(?::\d{1,10})?$', decoded_data):
+            splitData = decoded_data.split(":")
+            if live:
+                jobId = int(splitData[5]) if len(splitData) > 5 else None
+                self.healthMonitor.add(splitData[0])
+                if splitData[2] == 'START':
+                    PROFILER.asyncEnd('command.ack', splitData[0])
+                    self.jobScheduler.start(splitData[0], splitData[1], jobId)
+                if splitData[2] == 'END':
+                    self.jobScheduler.finish(splitData[0], splitData[1], jobId)
+            # If it's a scan/receive success, then the logentry will contain frequency and SF, otherwise not
+            if splitData[2] == 'SUCCESS':
+                self.logEntry("IP: {}, Mode: {}, Status: {}, Freq: {}, Spreading Factor: {}"
+                              .format(splitData[0], splitData[1], splitData[2], splitData[3], splitData[4]))
+            else:
+                self.logEntry("IP: {}, Mode: {}, Status: {}".format(splitData[0], splitData[1], splitData[2]))
+            if not live:
+                return
+            if splitData[1] == 'CAPTURE':
+                self.handleCapture(splitData[0], splitData[2])
+            if splitData[1] == 'BURST' and splitData[2] == 'START':
+                self.burstSent.pop(splitData[0], None)
+            if splitData[1] == 'BURSTRX' and splitData[2] == 'START':
+                self.burstStamps[splitData[0]] = []
+                self.burstReceived.pop(splitData[0], None)
+            if splitData[1] == 'BURSTRX' and splitData[2] == 'END':
+                threading.Thread(target=self.reportLatency, args=(splitData[0],), daemon=True).start()
+        # Regex for the statistics of a burst session. Example: 192.168.100.10:BURSTRX:STATS:95:5:0:1:1.52:6.08
+        # After IP, mode and status follow the received, lost, duplicated and reordered packets, the packets per
+        # second and the goodput in bytes per second.
+        elif re.match('^(?:\d{1,3}\.){3}\d{1,3}:(BURST|BURSTRX):STATS:(?:\d{1,10}:){4}\d+\.\d+:\d+\.\d+$',
+                      decoded_data):
+            splitData = decoded_data.strip().split(":")
+            if not live:
+                self.logEntry(burstStatsText(splitData))
+            elif splitData[1] == 'BURST':
+                self.burstSent[splitData[0]] = int(splitData[3])
+                self.logEntry(burstStatsText(splitData))
+                # the Rx statistics of this link which arrived before the end of the burst are logged again with the
+                # losses based on the sent packets
+                for rxHost, rxData in list(self.burstReceived.items()):
+                    if self.burstTxHost(rxHost) == splitData[0]:
+                        self.logEntry(burstStatsText(rxData, self.burstSent[splitData[0]]))
+            else:
+                self.burstReceived[splitData[0]] = splitData
+                self.logEntry(burstStatsText(splitData, self.burstSent.get(self.burstTxHost(splitData[0]))))
+        # Regex for a captured packet. Example: 192.168.100.10:CAPTURE:DATA:868000000:7:120:-97:7.25:4c6f5261
+        # After IP, mode and status follow frequency, SF, the age of the packet in ms, RSSI, SNR and the payload as hex
+        elif re.match('^(?:\d{1,3}\.){3}\d{1,3}:CAPTURE:DATA:\d{1,10}:\d{1,2}:\d{1,10}:-?\d+(?:\.\d+)?:'
+                      '-?\d+(?:\.\d+)?:(?:[0-9a-f]{2})*$', decoded_data):
+            if live:
+                splitData = decoded_data.split(":")
+                self.handleCapture(splitData[0], 'DATA', splitData)
+        # Regex for the timestamps of a burst Rx. Example: 192.168.100.10:BURSTRX:STAMP:17:1203391:1187122
+        # After IP, mode and status follow the sequence number, the Tx time of the sender and the Rx time in ms
+        elif re.match('^(?:\d{1,3}\.){3}\d{1,3}:BURSTRX:STAMP:\d{1,5}:\d{1,10}:\d{1,10}$', decoded_data) and live:
+            splitData = decoded_data.split(":")
+            self.burstStamps.setdefault(splitData[0], []).append((int(splitData[4]), int(splitData[5])))
+
+    # function to return the Tx node of a burst Rx node, the last one which got a burst with the same message
+    def burstTxHost(self, rxHost):
+        return self.burstTxHosts.get(self.burstRxMsgs.get(rxHost))
+
+    # function to calculate the Tx->Rx latencies of a finished burst Rx. Both nodes are synchronised again, so the drift
+    # since the start of the burst is known. The Tx node is the last one which got a burst with the same message.
+    def reportLatency(self, rxHost):
+        stamps = self.burstStamps.pop(rxHost, [])
+        txHost = self.burstTxHost(rxHost)
+        if not stamps or txHost is None:
+            return
+        for host in (rxHost, txHost):
+            if self.clockSync.ping(host) is None:
+                self.logEntry("WARNING: Clock sync with node {} after the burst failed, the drift is not measured and "
+                              "the latencies can be off by the drift since the start".format(host))
+        latencies = []
+        error = 0
+        for txTime, rxTime in stamps:
+            txLocal = self.clockSync.toLocal(txHost, txTime)
+            rxLocal = self.clockSync.toLocal(rxHost, rxTime)
+            if txLocal is None or rxLocal is None:
+                self.logEntry("Latency {} -> {} unknown, clock sync failed".format(txHost, rxHost))
+                return
+            latencies.append(rxLocal[0] - txLocal[0])
+            error = txLocal[1] + rxLocal[1]
+        for host in (txHost, rxHost):
+            refTime, offset, drift, hostError = self.clockSync.estimate(host)
+            self.logEntry("Clock of node {}: offset {:.1f} ms (+/- {:.1f} ms), drift {}"
+                          .format(host, offset, hostError,
+                                  "{:.1f} ppm".format(drift * 1000000) if drift is not None else "not measured"))
+        self.logEntry(latencyText(txHost, rxHost, latencies, error))
+
+    # function to open, write and close the capture file of a node. The capture file is opened on START (or with the
+    # first packet if the START got lost) and closed on END
+    def handleCapture(self, host, status, splitData=None):
+        with self.captureLock:
+            captureFile = self.captureFiles.get(host)
+            if status == 'END':
+                if captureFile is not None:
+                    captureFile.close()
+                    del self.captureFiles[host]
+                    # the saved file is indexed to check it and to log the time span of the captured packets
+                    index = indexCaptureFile(captureFile.path)
+                    span = ''
+                    if index:
+                        span = ' from {} to {}'.format(
+                            datetime.fromtimestamp(index[0][1]).strftime("%H:%M:%S.%f")[:-3],
+                            datetime.fromtimestamp(index[-1][1]).strftime("%H:%M:%S.%f")[:-3])
+                    self.logEntry('Capture of node {} saved: {} packets{} in {}'
+                                  .format(host, len(index), span, captureFile.path))
+                return
+            if captureFile is None:
+                path = 'LoRaCapture_{}_{}.pcap'.format(host, datetime.now().strftime("%Y%m%d_%H%M%S"))
+                captureFile = CaptureFile(path)
+                self.captureFiles[host] = captureFile
+                self.logEntry('Capture of node {} is written to {}'.format(host, path))
+            if status == 'DATA':
+                captureFile.write(time.time() - int(splitData[5]) / 1000, int(splitData[3]), int(splitData[4]),
+                                  float(splitData[6]), float(splitData[7]), bytes.fromhex(splitData[8]))
+
     # function to receive the client sockets and check the socket's message
     def ListenerDaemonFunc(self):
         print("ListenerDaemonFunc run")
         # function for each Thread to accept incoming data
-        def multiSession(connection):
+        def multiSession(connection, address, number):
             connection.send(str.encode('Server is listening'))
+            buffer = b''
             while True:
                 data = connection.recv(2048)
-                print(data.decode('utf-8'))
-                decoded_data = data.decode('utf-8')
-                # Regex to check if the message is a specific format. Example: 192.168.100.10:TX:START:868000000:11
-                # First part is the IP, second the mode (TX, RX or SCAN), third part the status (START, END or SUCCESS)
-                # and the fourth and fifth part is used for successful scans/receives to submit the frequency and spreading
-                # factor.
-                if re.match('^(?:\d{1,3}\.){3}\d{1,3}:(TX|RX|SCAN):(START|END|SUCCESS):\d{1,10}:\d{1,10}$',
-                            decoded_data):
-                    splitData = decoded_data.split(":")
-                    # If it's a scan/receive success, then the logentry will contain frequency and SF, otherwise not
-                    if splitData[2] == 'SUCCESS':
-                        self.logEntry("IP: {}, Mode: {}, Status: {}, Freq: {}, Spreading Factor: {}"
-                                      .format(splitData[0], splitData[1], splitData[2], splitData[3], splitData[4]))
-                    else:
-                        self.logEntry("IP: {}, Mode: {}, Status: {}".format(splitData[0], splitData[1], splitData[2]))
+                if self.recorder is not None:
+                    self.recorder.write(number, address, data)
                 if not data:
                     break
+                buffer = self.handleData(buffer, data)
+            if buffer:
+                self.parseFrame(buffer.decode('utf-8', 'replace'))
             connection.close()
         # main part of this socket listener which opens a new thread on connection
         try:
@@ -534,7 +1571,7 @@ class App(tk.Tk):
                 while True:
                     client, address = serverSocket.accept()
                     # start of new thread on successful socket connection
-                    start_new_thread(multiSession, (client,))
+                    start_new_thread(multiSession, (client, address, ThreadCount))
                     ThreadCount += 1
                     print('Thread Number: ' + str(ThreadCount))
         except OSError:
@@ -545,7 +1582,31 @@ class App(tk.Tk):
 
 # Mainloop of this application which starts the app class and closes the application with all active threads on
 # closure of the Tkinter GUI based on the App() class.
+# The listener traffic can be recorded with --record and replayed with --replay, either into the own GUI or with
+# --replay-to into another running listener without starting a GUI.
 if __name__ == "__main__":
-    app = App()
+    parser = argparse.ArgumentParser(description='LoRa Toolbox')
+    parser.add_argument('--record', metavar='FILE', help='record all data received by the listener')
+    parser.add_argument('--replay', metavar='FILE', help='replay a recording of the listener')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 1 = recorded speed, 0 = maximum')
+    parser.add_argument('--replay-to', metavar='HOST:PORT', help='replay into a running listener instead of the GUI')
+    parser.add_argument('--profile', action='store_true', help='start with profiling, SIGUSR1 switches it on and off')
+    args = parser.parse_args()
+    if args.profile:
+        PROFILER.start()
+    # signals to control the profiler at runtime (not available on Windows)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: PROFILER.toggle())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: PROFILER.enabled and PROFILER.dump())
+    if args.replay and args.replay_to:
+        host, port = args.replay_to.rsplit(':', 1)
+        replayRecording(args.replay, (host, int(port)), args.speed)
+        sys.exit()
+    app = App(FrameRecorder(args.record) if args.record else None)
+    if args.replay:
+        threading.Thread(target=replayRecording, args=(args.replay, app, args.speed), daemon=True).start()
     app.mainloop()
+    if app.recorder is not None:
+        app.recorder.close()
+    PROFILER.stop()
     sys.exit()
@@ -0,0 +1,494 @@
+##
+## Project: LoRa Toolbox
+## File name:: firmware_soak.py
+##
+## Description: Soak test of the LoPy firmware (LoPy/main.py) on the desktop
+## with CPython. The Pycom modules (network, pycom, machine, socket, select,
+## time and gc) are replaced by stubs with a virtual clock and a mocked radio,
+## the firmware is loaded without its main loop and the jobs LoRaRX, scan,
+## LoRaTX, LoRaCapture and LoRaBurstRX run for the given virtual minutes each
+## (a scan always takes its 17 minutes).
+##
+## CPython frees short-lived objects at once and keeps floats in a free list,
+## so the heap alone can't show the garbage of a loop. The firmware source is
+## therefore instrumented with the allocation rules of MicroPython: every
+## expression which creates a float, an int outside the small int range, a
+## string, bytes, a tuple, list, dict, slice or range object is counted with
+## its approximate size on the heap (for ... in range() is compiled to a plain
+## loop and doesn't allocate). The counts are split by poll of the job loop
+## (one call of serviceStatus):
+## - a poll without received packet has to be free of allocations
+## - the garbage is only collected by gcStep and heapCheck, the heap of the
+##   gc stub never fills up so no automatic collection happens in a loop
+## - the memory kept by the jobs (measured with tracemalloc) stays flat
+## The periodic reports sendStats and burstStats are allowed to allocate.
+##
+## Usage: python tools/firmware_soak.py [minutes per job]
+##
+
+import ast
+import collections
+import os
+import random
+import sys
+import tracemalloc
+import types
+import gc as realGc
+from array import array
+
+FIRMWARE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'LoPy', 'main.py')
+HEAP = 2500000          # free heap of a LoPy 4 after loading the firmware, reported by the gc stub
+SMALL_INT = 1 << 30     # ints below this fit into a pointer on MicroPython and are not allocated
+REPORTS = ('sendStats', 'burstStats')  # functions which may allocate, they run once per report
+SAMPLE = 10000          # ms of virtual time between two memory samples
+WARMUP = 60000          # ms of virtual time before the first sample counts
+MAX_GROWTH = 1024       # bytes the kept memory may grow after the warm-up
+SCAN_MINUTES = 17       # duration of a scan without received packets
+
+
+# virtual clock, the time only advances by sleeping, sending and receiving
+class Clock:
+    def __init__(self):
+        self.ms = 0
+        self.sampler = None
+
+    def advance(self, ms):
+        self.ms += ms
+        if self.sampler is not None:
+            self.sampler.check(self.ms)
+
+
+clock = Clock()
+baseline = 0            # traced memory after loading the firmware
+
+
+# samples of the kept memory of one job, preallocated so the samples themselves don't grow the heap
+class Sampler:
+    def __init__(self, name, minutes):
+        self.name = name
+        self.values = array('q', [0] * ((minutes + SCAN_MINUTES) * 60000 // SAMPLE + 2))
+        self.count = 0
+        self.next = clock.ms + WARMUP
+
+    def check(self, ms):
+        if ms >= self.next and self.count < len(self.values):
+            self.next = ms + SAMPLE
+            self.values[self.count] = tracemalloc.get_traced_memory()[0] - baseline
+            self.count += 1
+
+    def growth(self):
+        if self.count < 2:
+            return 0
+        return self.values[self.count - 1] - self.values[0]
+
+
+# function to return the approximate size of an object on the MicroPython heap, 0 if it isn't allocated
+def heapSize(value):
+    if isinstance(value, bool) or value is None:
+        return 0
+    if isinstance(value, float):
+        return 16
+    if isinstance(value, int):
+        return 16 if not -SMALL_INT <= value < SMALL_INT else 0
+    if isinstance(value, (str, bytes, bytearray)):
+        return 16 + (len(value) + 15) // 16 * 16
+    if isinstance(value, (tuple, list, dict, set)):
+        return 16 + (len(value) * 4 + 15) // 16 * 16
+    if isinstance(value, (slice, range, memoryview, array, types.FunctionType)):
+        return 16
+    return 0
+
+
+# allocation counter of the instrumented firmware. A window is the time between two polls of a job loop, it's
+# counted as packet window if a LoRa packet was received in it.
+class Meter:
+    def __init__(self):
+        self.heap = 0
+        self.reset()
+
+    def reset(self):
+        self.started = False
+        self.window = 0
+        self.windowLines = []
+        self.windowPacket = False
+        self.idlePolls = 0
+        self.idleAllocs = 0
+        self.packetPolls = 0
+        self.packetAllocs = 0
+        self.idleLines = collections.Counter()
+        self.packetLines = collections.Counter()
+        self.collections = 0
+        self.autoCollections = 0
+
+    def alloc(self, value, line, function):
+        size = heapSize(value)
+        if not size:
+            return value
+        self.heap += size
+        if self.heap > HEAP:
+            self.autoCollections += 1
+            self.heap = 0
+        if self.started and function not in REPORTS:
+            self.window += 1
+            self.windowLines.append(line)
+        return value
+
+    def poll(self):
+        if self.started:
+            if self.windowPacket:
+                self.packetPolls += 1
+                self.packetAllocs += self.window
+                self.packetLines.update(self.windowLines)
+            else:
+                self.idlePolls += 1
+                self.idleAllocs += self.window
+                self.idleLines.update(self.windowLines)
+        self.started = True
+        self.window = 0
+        self.windowLines.clear()
+        self.windowPacket = False
+
+    def collect(self):
+        self.collections += 1
+        self.heap = 0
+
+
+meter = Meter()
+
+
+# class to wrap every allocating expression of the firmware into _alloc(expression, line, function)
+class Instrument(ast.NodeTransformer):
+    def __init__(self, functions):
+        self.functions = functions
+        self.function = ''
+
+    def wrap(self, node):
+        self.generic_visit(node)
+        call = ast.Call(func=ast.Name(id='_alloc', ctx=ast.Load()),
+                        args=[node, ast.Constant(node.lineno), ast.Constant(self.function)], keywords=[])
+        return ast.copy_location(call, node)
+
+    def visit_FunctionDef(self, node):
+        self.function = node.name
+        self.generic_visit(node)
+        self.function = ''
+        return node
+
+    def visit_For(self, node):
+        # for ... in range() doesn't allocate the range
+        if isinstance(node.iter, ast.Call) and isinstance(node.iter.func, ast.Name) and node.iter.func.id == 'range':
+            node.iter.args = [self.visit(arg) for arg in node.iter.args]
+            node.body = [self.visit(statement) for statement in node.body]
+            node.orelse = [self.visit(statement) for statement in node.orelse]
+            return node
+        self.generic_visit(node)
+        return node
+
+    def visit_Assign(self, node):
+        # a, b = b, a with up to 3 values is done on the stack
+        if (isinstance(node.value, ast.Tuple) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Tuple)
+                and len(node.value.elts) == len(node.targets[0].elts) <= 3):
+            node.targets = [self.visit(target) for target in node.targets]
+            node.value.elts = [self.visit(value) for value in node.value.elts]
+            return node
+        self.generic_visit(node)
+        return node
+
+    def visit_Call(self, node):
+        # the results of firmware functions were already counted where they were created
+        if isinstance(node.func, ast.Name) and node.func.id in self.functions:
+            self.generic_visit(node)
+            return node
+        return self.wrap(node)
+
+    def visit_Subscript(self, node):
+        if isinstance(node.slice, ast.Slice) and isinstance(node.ctx, ast.Load):
+            return self.wrap(node)
+        self.generic_visit(node)
+        return node
+
+    def visit_Container(self, node):
+        if isinstance(node.ctx, ast.Load):
+            return self.wrap(node)
+        self.generic_visit(node)
+        return node
+
+    visit_BinOp = wrap
+    visit_UnaryOp = wrap
+    visit_JoinedStr = wrap
+    visit_Dict = wrap
+    visit_Set = wrap
+    visit_ListComp = wrap
+    visit_Tuple = visit_Container
+    visit_List = visit_Container
+
+
+# radio of the mocked LoRa sockets, the current job sets the packet source
+class Radio:
+    def __init__(self):
+        self.source = None
+        self.received = 0
+
+    def readinto(self, buf):
+        clock.advance(1)
+        n = self.source(buf) if self.source is not None else 0
+        if n:
+            self.received += 1
+            meter.windowPacket = True
+        return n
+
+
+radio = Radio()
+
+# the LoPy returns a new tuple with every call of stats()
+Stats = collections.namedtuple('Stats', ('rx_timestamp', 'rssi', 'snr', 'sftx', 'sfrx', 'tx_trials', 'tx_power'))
+
+
+class LoRa:
+    LORA = 0
+    EU868 = 5
+    BW_125KHZ = 0
+    BW_250KHZ = 1
+    BW_500KHZ = 2
+    CODING_4_5 = 1
+    CODING_4_6 = 2
+    CODING_4_7 = 3
+    CODING_4_8 = 4
+
+    def __init__(self, **kwargs):
+        pass
+
+    def stats(self):
+        return Stats(clock.ms, -97, 7.25, 7, 7, 1, 14)
+
+    def frequency(self, freq=None):
+        return 868000000
+
+    def sf(self, sf=None):
+        return 7
+
+
+class Net:
+    ssid = 'LoRaToolbox'
+    sec = 3
+
+
+class WLAN:
+    STA = 1
+
+    def __init__(self, **kwargs):
+        pass
+
+    def scan(self):
+        return [Net()]
+
+    def connect(self, *args, **kwargs):
+        pass
+
+    def isconnected(self):
+        return True
+
+    def ifconfig(self):
+        return ('192.168.4.2', '255.255.255.0', '192.168.4.1', '192.168.4.1')
+
+    def joined_ap_info(self):
+        return (b'', 'LoRaToolbox', 3, 1, -60)
+
+
+# sockets, LoRa sockets use the radio and the job stream discards everything it gets
+class Socket:
+    lines = 0
+    sent = 0
+
+    def __init__(self, family=2, kind=1):
+        pass
+
+    def setblocking(self, flag):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def readinto(self, buf):
+        return radio.readinto(buf)
+
+    def send(self, data):
+        Socket.sent += 1
+        clock.advance(50)
+
+    def connect(self, address):
+        pass
+
+    def write(self, data, length=None):
+        Socket.lines += 1
+
+    def sendall(self, data):
+        pass
+
+    def bind(self, address):
+        pass
+
+    def listen(self, backlog):
+        pass
+
+    def close(self):
+        pass
+
+
+# poller without requests, ipoll returns the poller itself as empty iterator like MicroPython
+class Poll:
+    def register(self, *args):
+        pass
+
+    def ipoll(self, timeout):
+        meter.poll()
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raise StopIteration
+
+
+def sleepMs(ms):
+    clock.advance(max(1, ms))
+
+
+def stubModules():
+    modules = {
+        'network': types.SimpleNamespace(WLAN=WLAN, LoRa=LoRa),
+        'pycom': types.SimpleNamespace(heartbeat=lambda state=None: None),
+        'machine': types.SimpleNamespace(reset=lambda: None),
+        'socket': types.SimpleNamespace(socket=Socket, AF_LORA=160, SOCK_RAW=3, AF_INET=2, SOCK_STREAM=1),
+        'select': types.SimpleNamespace(poll=Poll, POLLIN=1),
+        # the RTC of the node isn't set, so time() counts the seconds since 1970-01-01 plus the uptime
+        'time': types.SimpleNamespace(
+            ticks_ms=lambda: clock.ms,
+            ticks_diff=lambda a, b: a - b,
+            ticks_add=lambda a, b: a + b,
+            sleep_ms=sleepMs,
+            sleep=lambda seconds: sleepMs(int(seconds * 1000)),
+            time=lambda: clock.ms // 1000),
+        'gc': types.SimpleNamespace(
+            collect=meter.collect,
+            mem_alloc=lambda: meter.heap,
+            mem_free=lambda: HEAP - meter.heap),
+    }
+    sys.modules.update(modules)
+
+
+# function to load the instrumented firmware without its main loop, the prints are discarded
+def loadFirmware():
+    with open(FIRMWARE) as firmwareFile:
+        source = firmwareFile.read()
+    tree = ast.parse(source[:source.index('# Main loop for the MicroController')], FIRMWARE)
+    functions = {node.name for node in tree.body if isinstance(node, ast.FunctionDef)}
+    tree = ast.fix_missing_locations(Instrument(functions).visit(tree))
+    firmware = {'__name__': 'firmware', 'print': lambda *args, **kwargs: None, '_alloc': meter.alloc}
+    exec(compile(tree, FIRMWARE, 'exec'), firmware)
+    return firmware
+
+
+# packet sources of the jobs, they write straight into the receive buffer of the firmware
+def rxSource(rng):
+    def source(buf):
+        if rng.random() < 0.05:
+            buf[0:4] = b'LoRa'
+            return 4
+        return 0
+    return source
+
+
+def scanSource(rng):
+    def source(buf):
+        if rng.random() < 0.0005:
+            buf[0:4] = b'LoRa'
+            return 4
+        return 0
+    return source
+
+
+def captureSource(rng):
+    def source(buf):
+        if rng.random() < 0.3:
+            length = rng.randint(1, 200)
+            buf[0:2] = b'Lo' if rng.random() < 0.7 else b'xx'
+            for i in range(2, length):
+                buf[i] = rng.randrange(256)
+            return length
+        return 0
+    return source
+
+
+# burst packets with losses and duplicates, every 2000 sequence numbers a new burst starts at 0
+def burstSource(rng):
+    state = {'seq': 0, 'last': 0}
+    def source(buf):
+        if rng.random() < 0.2:
+            return 0
+        seq = state['seq']
+        if rng.random() < 0.02:
+            seq = state['last']
+        else:
+            state['last'] = seq
+            state['seq'] = (seq + rng.choice((1, 1, 1, 1, 2, 3))) % 2000
+        txTime = clock.ms - 120
+        buf[0:4] = b'LoRa'
+        buf[4] = seq >> 8
+        buf[5] = seq & 255
+        buf[6] = (txTime >> 24) & 255
+        buf[7] = (txTime >> 16) & 255
+        buf[8] = (txTime >> 8) & 255
+        buf[9] = txTime & 255
+        return 10
+    return source
+
+
+def main():
+    minutes = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    stubModules()
+    tracemalloc.start()
+    firmware = loadFirmware()
+    global baseline
+    baseline = tracemalloc.get_traced_memory()[0]
+    firmware.update(SF='7', FQ='868000000', BW=125, TX='14', FEC=4_5)
+    rng = random.Random(1)
+    # job, message, packet source, Repeat and Pause
+    jobs = [('LoRaRX', 'LoRa', rxSource(rng), str(minutes), '0'),
+            ('scan', '', scanSource(rng), '0', '0'),
+            ('LoRaTX', 'LoRa', None, str(minutes * 60), '1'),
+            ('LoRaCapture', 'LoRa|0x4c6f', captureSource(rng), str(minutes), '0'),
+            ('LoRaBurstRX', 'LoRa', burstSource(rng), str(minutes), '0')]
+    print("Soak test of {} with {} virtual minutes per job".format(os.path.normpath(FIRMWARE), minutes))
+    failed = False
+    for name, msg, source, repeat, pause in jobs:
+        firmware.update(Repeat=repeat, Pause=pause)
+        radio.source = source
+        radio.received = 0
+        Socket.lines = 0
+        Socket.sent = 0
+        meter.reset()
+        clock.sampler = Sampler(name, minutes)
+        firmware[name]('192.168.4.1', msg)
+        firmware['closeStream']()
+        growth = clock.sampler.growth()
+        clock.sampler = None
+        print("{:<12} idle polls: {:8}  allocations: {:6}  packet polls: {:7}  allocations per packet: {:.2f}".format(
+            name, meter.idlePolls, meter.idleAllocs, meter.packetPolls,
+            meter.packetAllocs / meter.packetPolls if meter.packetPolls else 0))
+        print("{:<12} collections: {} by gcStep, {} automatic  kept memory growth: {} bytes  "
+              "packets received: {}, sent: {}, lines: {}".format(
+                  '', meter.collections, meter.autoCollections, growth, radio.received, Socket.sent, Socket.lines))
+        for line, count in meter.idleLines.most_common(5):
+            print("{:<12} {} allocations in idle polls at line {}".format('', count, line))
+        for line, count in meter.packetLines.most_common(3):
+            print("{:<12} {} allocations in packet polls at line {}".format('', count, line))
+        if meter.idleAllocs or meter.autoCollections or growth > MAX_GROWTH:
+            failed = True
+    print('FAILED: a job loop makes garbage or keeps memory' if failed else 'OK: no garbage in idle polls and flat memory')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())